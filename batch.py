@@ -0,0 +1,329 @@
+#! /usr/bin/env python3
+# coding: utf-8
+"""Runs the traffic counting over a directory (or a manifest) of videos with a pool of warm detector workers
+
+Counts and speeds of every video are written to a sqlite results store, which is also the job ledger :
+an interrupted batch started again with the same store resumes where it stopped.
+
+usage : python batch.py --in videos/ --db batch.db -j 2
+"""
+
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import sqlite3
+import time
+
+import cv2
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (path TEXT PRIMARY KEY, status TEXT, worker INTEGER, attempts INTEGER,
+                                 started REAL, finished REAL, n_frames INTEGER, error TEXT);
+CREATE TABLE IF NOT EXISTS counts (path TEXT, counter INTEGER, cls TEXT, count INTEGER);
+CREATE TABLE IF NOT EXISTS speeds (path TEXT, idczone INTEGER, track_id INTEGER, speed REAL);
+"""
+
+
+class JobLedger:
+    """JobLedger class keeps the status of the batch jobs and their results in a sqlite database
+
+    Note : job status is one of 'pending', 'running', 'done', 'failed' or 'timeout'.
+           Only the parent process writes to the database.
+
+    Args:
+        db_path (str): path of the sqlite database
+
+    Attributes:
+        db (sqlite3 connection): database connection
+    """
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def add(self, paths, retry_failed=False):
+        """Adds the new videos as pending jobs, and resets the jobs interrupted while running
+
+        Args:
+            paths (list of str): videos paths
+            retry_failed (bool): also reset the failed and timed out jobs
+        """
+        self.db.executemany("INSERT OR IGNORE INTO jobs (path, status, attempts) VALUES (?, 'pending', 0)",
+                            [(path,) for path in paths])
+        reset = ('running', 'failed', 'timeout') if retry_failed else ('running',)
+        self.db.execute("UPDATE jobs SET status = 'pending' WHERE status IN ({})".format(
+            ','.join('?' * len(reset))), reset)
+        self.db.commit()
+
+    def pending(self):
+        """Returns the paths of the pending jobs
+        """
+        return [row[0] for row in self.db.execute("SELECT path FROM jobs WHERE status = 'pending' ORDER BY path")]
+
+    def start(self, path, worker):
+        """Marks a job as running on a worker
+        """
+        self.db.execute("UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, started = ? "
+                        "WHERE path = ?", (worker, time.time(), path))
+        self.db.commit()
+
+    def finish(self, path, status, n_frames=None, error=None, counts=None, speeds=None):
+        """Records the end of a job and its results in a single transaction
+
+        Args:
+            path (str): video path
+            status (str): 'done', 'failed' or 'timeout'
+            n_frames (int): number of processed frames
+            error (str): error message
+            counts (list of dict): counts_classes of each counter
+            speeds (dict): estimated speeds of each control zone (TrackerSpeedEstimator.estimated_speed)
+        """
+        with self.db:
+            self.db.execute("DELETE FROM counts WHERE path = ?", (path,))
+            self.db.execute("DELETE FROM speeds WHERE path = ?", (path,))
+            for icounter, counts_classes in enumerate(counts or []):
+                self.db.executemany("INSERT INTO counts VALUES (?, ?, ?, ?)",
+                                    [(path, icounter, cls, n) for cls, n in counts_classes.items()])
+            for idczone, zone_speeds in (speeds or {}).items():
+                self.db.executemany("INSERT INTO speeds VALUES (?, ?, ?, ?)",
+                                    [(path, idczone, track_id, speed) for track_id, speed in zone_speeds.items()])
+            self.db.execute("UPDATE jobs SET status = ?, finished = ?, n_frames = ?, error = ? WHERE path = ?",
+                            (status, time.time(), n_frames, error, path))
+
+    def summary(self):
+        """Returns the number of jobs per status
+        """
+        return dict(self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+def worker_loop(iworker, weights_path, jobs, results):
+    """Worker process : loads the detector once, then processes the videos sent through its jobs queue
+
+    Args:
+        iworker (int): worker index
+        weights_path (str): path to the yolov3 weights
+        jobs (multiprocessing Queue): videos paths, None to stop
+        results (multiprocessing Connection): writing end of the worker results pipe,
+                                              (worker, path, status, payload) results
+    """
+    from config import Config
+    from detector import YOLOV3Detector
+    from main import build_counters, build_czones, run
+
+    classes = ['car', 'truck', 'motorcycle']
+    config = Config()
+    detector = YOLOV3Detector(cls=classes, weights_path=weights_path)
+    results.send((iworker, None, 'ready', None))
+
+    while True:
+        path = jobs.get()
+        if path is None:
+            break
+        try:
+            video_capture = cv2.VideoCapture(path)
+            if not video_capture.isOpened():
+                raise IOError("Cannot open video {}".format(path))
+            height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            counters = build_counters(config.parse_counters(), classes)
+            czones = build_czones(config.parse_czones(), height, width)
+
+            trackerspeed = run(video_capture, detector, counters, czones, classes, out=None, show=False)
+            n_frames = int(video_capture.get(cv2.CAP_PROP_POS_FRAMES))
+            video_capture.release()
+
+            payload = dict(n_frames=n_frames, counts=[counter.counts_classes for counter in counters],
+                           speeds={idczone: {int(k): float(v) for k, v in zone_speeds.items()}
+                                   for idczone, zone_speeds in trackerspeed.estimated_speed.items()})
+            results.send((iworker, path, 'done', payload))
+        except Exception as e:
+            results.send((iworker, path, 'failed', dict(error=repr(e))))
+
+    detector.close()
+
+
+class WorkerPool:
+    """WorkerPool class manages the worker processes, one job at a time per worker
+
+    Note : a worker exceeding the job timeout is killed and replaced by a new one (which reloads the model).
+           Each worker sends its results through its own pipe, a worker killed while sending only breaks its
+           own pipe, which is dropped with it.
+
+    Args:
+        n_workers (int): number of worker processes
+        weights_path (str): path to the yolov3 weights
+        timeout (float): maximum duration of a job in seconds (the model loading is not included)
+    """
+
+    def __init__(self, n_workers, weights_path, timeout):
+        self.weights_path = weights_path
+        self.timeout = timeout
+        # spawn : every worker builds its own tensorflow session
+        self.ctx = multiprocessing.get_context('spawn')
+        self.workers = {}
+        for iworker in range(n_workers):
+            self._spawn(iworker)
+
+    def _spawn(self, iworker):
+        jobs = self.ctx.Queue()
+        results, worker_results = self.ctx.Pipe(duplex=False)
+        process = self.ctx.Process(target=worker_loop, args=(iworker, self.weights_path, jobs, worker_results),
+                                   daemon=True)
+        process.start()
+        # the worker has its own copy of the writing end
+        worker_results.close()
+        self.workers[iworker] = dict(process=process, jobs=jobs, results=results, job=None, started=None,
+                                     ready=False)
+
+    def idle(self):
+        """Returns the indexes of the ready workers without job
+        """
+        return [i for i, w in self.workers.items() if w['ready'] and w['job'] is None]
+
+    def busy(self):
+        """Returns True if any worker is running a job
+        """
+        return any(w['job'] is not None for w in self.workers.values())
+
+    def submit(self, iworker, path):
+        """Sends a video to an idle worker
+        """
+        worker = self.workers[iworker]
+        worker['job'], worker['started'] = path, time.time()
+        worker['jobs'].put(path)
+
+    def poll(self, wait=1.):
+        """Waits for the next result and checks the job timeouts
+
+        Returns:
+            finished (list of tuple): (worker, path, status, payload, duration) finished jobs
+        """
+        finished = []
+        readers = {worker['results']: iworker for iworker, worker in self.workers.items()}
+        for reader in multiprocessing.connection.wait(list(readers), timeout=wait):
+            try:
+                _, path, status, payload = reader.recv()
+            except (EOFError, OSError):
+                # the worker died, it is replaced below
+                continue
+            iworker = readers[reader]
+            worker = self.workers[iworker]
+            if status == 'ready':
+                worker['ready'] = True
+            elif path == worker['job']:
+                finished.append((iworker, path, status, payload, time.time() - worker['started']))
+                worker['job'] = None
+
+        for iworker, worker in list(self.workers.items()):
+            dead = not worker['process'].is_alive()
+            late = worker['job'] is not None and time.time() - worker['started'] > self.timeout
+            if dead and not worker['ready']:
+                raise RuntimeError("Worker {} failed to start (exit code {})".format(
+                    iworker, worker['process'].exitcode))
+            if dead or late:
+                if worker['job'] is not None:
+                    finished.append((iworker, worker['job'], 'timeout' if late else 'failed',
+                                     dict(error='job timeout' if late else 'worker died'),
+                                     time.time() - worker['started']))
+                worker['process'].terminate()
+                worker['process'].join()
+                worker['results'].close()
+                self._spawn(iworker)
+        return finished
+
+    def close(self):
+        for worker in self.workers.values():
+            if worker['process'].is_alive():
+                worker['jobs'].put(None)
+        for worker in self.workers.values():
+            worker['process'].join(timeout=30)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+            worker['results'].close()
+
+
+def list_videos(input_path):
+    """Lists the videos of a directory, or of a manifest file with one video path per line
+
+    Args:
+        input_path (str): directory or manifest path
+    Returns:
+        paths (list of str): absolute videos paths
+    """
+    if os.path.isdir(input_path):
+        paths = [os.path.join(input_path, name) for name in sorted(os.listdir(input_path))
+                 if name.lower().endswith(VIDEO_EXTENSIONS)]
+    else:
+        with open(input_path) as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return [os.path.abspath(path) for path in paths]
+
+
+def main():
+    input_path, db_path, weights_path, n_workers, timeout, retry_failed = get_args()
+
+    ledger = JobLedger(db_path)
+    ledger.add(list_videos(input_path), retry_failed=retry_failed)
+    pending = ledger.pending()
+    print("{} jobs to run, {}".format(len(pending), ledger.summary()))
+    if len(pending) == 0:
+        return
+
+    t0 = time.time()
+    stats = {}
+    pool = WorkerPool(n_workers, weights_path, timeout)
+    try:
+        while len(pending) > 0 or pool.busy():
+            for iworker in pool.idle():
+                if len(pending) == 0:
+                    break
+                path = pending.pop(0)
+                ledger.start(path, iworker)
+                pool.submit(iworker, path)
+
+            for iworker, path, status, payload, duration in pool.poll():
+                ledger.finish(path, status, n_frames=payload.get('n_frames'), error=payload.get('error'),
+                              counts=payload.get('counts'), speeds=payload.get('speeds'))
+                worker_stats = stats.setdefault(iworker, dict(jobs=0, failed=0, frames=0, seconds=0.))
+                worker_stats['jobs'] += 1
+                worker_stats['failed'] += status != 'done'
+                worker_stats['frames'] += payload.get('n_frames') or 0
+                worker_stats['seconds'] += duration
+                print("[worker {}] {} {} ({:.1f}s)".format(iworker, status, path, duration))
+    finally:
+        pool.close()
+
+    print("\nworker   jobs  failed    frames   seconds       fps")
+    for iworker, s in sorted(stats.items()):
+        print("{:>6} {:>6} {:>7} {:>9} {:>9.1f} {:>9.1f}".format(iworker, s['jobs'], s['failed'], s['frames'],
+                                                                  s['seconds'], s['frames'] / max(s['seconds'], 1e-9)))
+    total_frames = sum(s['frames'] for s in stats.values())
+    wall = time.time() - t0
+    print("total : {} frames in {:.1f}s ({:.1f} fps), {}".format(total_frames, wall, total_frames / wall,
+                                                                ledger.summary()))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Run the traffic counting over a directory of videos')
+    parser.add_argument('--in', dest='input_path', default="videos",
+                        help='Directory of the input videos, or manifest file with one video path per line')
+    parser.add_argument('--db', dest='db_path', default="batch.db",
+                        help='Path the sqlite results store and job ledger')
+    parser.add_argument('-w', dest='weights', default="yolov3_weights/pretrained-yolov3.h5",
+                        help='Path the yolov3 weights')
+    parser.add_argument('-j', dest='n_workers', type=int, default=1,
+                        help='Number of worker processes')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=3600,
+                        help='Maximum duration of a job in seconds')
+    parser.add_argument('--retry-failed', dest='retry_failed', action='store_true',
+                        help='Run again the failed and timed out jobs')
+    args = parser.parse_args()
+    return args.input_path, args.db_path, args.weights, args.n_workers, args.timeout, args.retry_failed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+# coding: utf-8
+"""End-to-end throughput versus accuracy matrix of the main.py pipeline on synthetic clips
+
+Each clip is rendered with the icons/ sprites and ground truth vehicle paths, classes and speeds, then run through
+main.run with a stand-in detector built from the ground truth (with jitter and dropouts). For every combination
+of maxDisappeared, frame size and detection rate the table reports the pipeline fps, the count error of each
+Counter and the speed error of each Control_zone.
+
+usage : python benchmarks/bench_accuracy.py
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from main import build_counters, build_czones, run
+from synthetic import SyntheticClip, SyntheticDetector
+
+
+def evaluate(clip, clip_path, max_disappeared, detect_every, jitter, dropout):
+    """Runs the pipeline over a rendered clip and compares the counts and speeds with the ground truth
+
+    Returns:
+        fps (float): pipeline frames per second
+        count_errors (list of float): relative absolute count error of each counter (summed over the classes)
+        speed_errors (list of tuple float): (mean absolute error of the zone average speed in km/h,
+                                             measured vehicles / ground truth vehicles) of each control zone
+    """
+    video_capture = cv2.VideoCapture(clip_path)
+    counters = build_counters(clip.counters_ini, clip.classes)
+    czones = build_czones(clip.czones_ini, clip.height, clip.width)
+    detector = SyntheticDetector(clip, video_capture, jitter=jitter, dropout=dropout)
+
+    t0 = time.perf_counter()
+    trackerspeed = run(video_capture, detector, counters, czones, clip.classes, out=None, show=False,
+                       max_disappeared=max_disappeared, detect_every=detect_every)
+    fps = clip.n_frames / (time.perf_counter() - t0)
+    video_capture.release()
+
+    count_errors = []
+    for counter, border in zip(counters, clip.counters_ini):
+        truth = clip.true_counts(border)
+        error = sum(abs(counter.counts_classes.get(cls, 0) - n) for cls, n in truth.items())
+        count_errors.append(error / max(1, sum(truth.values())))
+
+    speed_errors = []
+    for czone, czone_ini in zip(czones, clip.czones_ini):
+        truth = list(clip.true_speeds(czone_ini).values())
+        measured = list(trackerspeed.estimated_speed[czone.idczone].values())
+        if len(truth) == 0 or len(measured) == 0:
+            speed_errors.append((np.nan, len(measured) / max(1, len(truth))))
+        else:
+            speed_errors.append((abs(np.mean(measured) - np.mean(truth)), len(measured) / len(truth)))
+    return fps, count_errors, speed_errors
+
+
+def main():
+    args = get_args()
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes]
+
+    header = "{:>10} {:>6} {:>7} {:>8}".format("size", "maxDis", "detect", "fps")
+    header += "".join(" {:>10}".format("count{}".format(i)) for i in range(2))
+    header += "".join(" {:>17}".format("speed{} err/cov".format(i)) for i in range(2))
+    print(header)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for width, height in sizes:
+            clip = SyntheticClip(height=height, width=width, n_frames=args.n_frames, seed=args.seed)
+            clip_path = os.path.join(tmpdir, "clip_{}x{}.avi".format(width, height))
+            clip.render(clip_path)
+
+            for max_disappeared, detect_every in itertools.product(args.max_disappeared, args.detect_every):
+                fps, count_errors, speed_errors = evaluate(clip, clip_path, max_disappeared, detect_every,
+                                                           args.jitter, args.dropout)
+                line = "{:>10} {:>6} {:>7} {:>8.1f}".format("{}x{}".format(width, height), max_disappeared,
+                                                             "1/{}".format(detect_every), fps)
+                line += "".join(" {:>10.1%}".format(error) for error in count_errors)
+                line += "".join(" {:>9.1f} / {:>5.0%}".format(error, coverage) for error, coverage in speed_errors)
+                print(line)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Throughput versus accuracy matrix on synthetic clips')
+    parser.add_argument('--frames', dest='n_frames', type=int, default=500, help='Number of frames per clip')
+    parser.add_argument('--sizes', dest='sizes', nargs='+', default=['640x360', '1280x720'],
+                        help='Frame sizes (WIDTHxHEIGHT)')
+    parser.add_argument('--max-disappeared', dest='max_disappeared', type=int, nargs='+', default=[2, 8, 20],
+                        help='CentroidTracker maxDisappeared values')
+    parser.add_argument('--detect-every', dest='detect_every', type=int, nargs='+', default=[1, 2, 4],
+                        help='Detection rates (the detector runs once every N frames)')
+    parser.add_argument('--jitter', dest='jitter', type=float, default=2., help='Boxes jitter in pixels')
+    parser.add_argument('--dropout', dest='dropout', type=float, default=0.05, help='Detection dropout rate')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, help='Random seed of the clips')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
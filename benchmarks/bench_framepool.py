@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+# coding: utf-8
+"""Per-frame allocations and throughput of the main.py frame loop with and without the frame buffer pool
+
+The loop runs on a rendered synthetic clip with the ground truth stand-in detector (the YOLOv3 inference is not
+included). Transient allocations are the peak traced memory between two frame reads.
+
+usage : python benchmarks/bench_framepool.py
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from main import build_counters, build_czones, run
+from synthetic import SyntheticClip, SyntheticDetector
+
+
+class TracedCapture:
+    """VideoCapture wrapper recording the peak traced memory allocated between two reads"""
+
+    def __init__(self, video_capture):
+        self.cap = video_capture
+        self.peaks = []
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+    def read(self, image=None):
+        # peak since the previous read, the tracing is restarted to reset it (tracemalloc.reset_peak needs
+        # python 3.9), so the peak only counts the memory allocated after the previous read
+        _, peak = tracemalloc.get_traced_memory()
+        self.peaks.append(peak)
+        tracemalloc.stop()
+        tracemalloc.start()
+        return self.cap.read(image=image)
+
+
+def run_clip(clip, clip_path, frame_pool, traced):
+    video_capture = cv2.VideoCapture(clip_path)
+    if traced:
+        video_capture = TracedCapture(video_capture)
+    counters = build_counters(clip.counters_ini, clip.classes)
+    czones = build_czones(clip.czones_ini, clip.height, clip.width)
+    detector = SyntheticDetector(clip, video_capture)
+
+    t0 = time.perf_counter()
+    run(video_capture, detector, counters, czones, clip.classes, out=None, show=False, frame_pool=frame_pool)
+    elapsed = time.perf_counter() - t0
+    return clip.n_frames / elapsed, getattr(video_capture, 'peaks', [])
+
+
+def main():
+    args = get_args()
+    width, height = (int(v) for v in args.size.split('x'))
+    clip = SyntheticClip(height=height, width=width, n_frames=args.n_frames)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        clip_path = os.path.join(tmpdir, "clip.avi")
+        clip.render(clip_path)
+
+        print("{:>10} {:>28} {:>10}".format("pool", "peak allocated MB / frame", "fps"))
+        for frame_pool in [False, True]:
+            tracemalloc.start()
+            _, peaks = run_clip(clip, clip_path, frame_pool, traced=True)
+            tracemalloc.stop()
+            fps, _ = run_clip(clip, clip_path, frame_pool, traced=False)
+            # skip the first frames (buffers allocation)
+            peaks = peaks[5:]
+            print("{:>10} {:>28.2f} {:>10.1f}".format(str(frame_pool), sum(peaks) / len(peaks) / 2 ** 20, fps))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Frame buffer pool benchmark')
+    parser.add_argument('--frames', dest='n_frames', type=int, default=200, help='Number of frames of the clip')
+    parser.add_argument('--size', dest='size', default='1920x1080', help='Frame size (WIDTHxHEIGHT)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+# coding: utf-8
+"""Per-frame cost of the counting and the speed estimation as the number of counters lines and
+control zones grows, with and without the spatial index.
+
+The geometry is kept at a constant density : each counter and its control zone are placed in their own
+TILE_WIDTH wide column of a frame that grows with the number of lines, and the same number of objects move over it.
+
+usage : python benchmarks/bench_spatialindex.py
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from controlzone import Control_zone
+from counter import Counter, count_classes_indexed
+from spatialindex import build_index
+from trackerspeedestimator import TrackerSpeedEstimator
+
+HEIGHT = 1080
+TILE_WIDTH = 200
+TILE_ROWS = [250, 450, 650, 850]
+CLASSES = ['car', 'truck', 'motorcycle']
+
+
+class FrameClock:
+    """Minimal frame position source with the VideoCapture get interface used by TrackerSpeedEstimator"""
+
+    def __init__(self, fps=25):
+        self.fps = fps
+        self.frameid = 0
+
+    def get(self, prop):
+        return self.fps if prop == cv2.CAP_PROP_FPS else self.frameid
+
+
+def build_geometry(n_lines):
+    """Places the counter and the control zone i in the column i of the frame (non-overlapping tiles)"""
+    width = n_lines * TILE_WIDTH
+    counters, czones = [], []
+    for i in range(n_lines):
+        x = i * TILE_WIDTH + 25
+        y = TILE_ROWS[i % len(TILE_ROWS)]
+        counters.append(Counter(border=(x, y, x + 150, y), cls=CLASSES, color=(0, 0, 255), draw_loc='top-left'))
+        y2 = y - 80
+        czones.append(Control_zone(idczone=i, height=HEIGHT, width=width,
+                                   x1y1x2y2=((x + 150, y2), (x, y2)), x3y3x4y4=((x, y), (x + 150, y)),
+                                   ckzn_d=20, speedlimit=90, col=(0, 0, 255), draw_loc='top-left'))
+    return counters, czones, width
+
+
+def run(n_lines, n_objects=60, n_frames=50, indexed=True):
+    rng = np.random.RandomState(0)
+    counters, czones, width = build_geometry(n_lines)
+    index = build_index(counters, czones, HEIGHT, width) if indexed else None
+    clock = FrameClock()
+    tse = TrackerSpeedEstimator(video_capture=clock, czones=czones, index=index)
+
+    start = rng.uniform((0, 0), (width, HEIGHT), size=(n_objects, 2))
+    velocity = rng.uniform(-8, 8, size=(n_objects, 2))
+    classes = {i: i % len(CLASSES) for i in range(n_objects)}
+
+    t0 = time.perf_counter()
+    for frameid in range(n_frames):
+        clock.frameid = frameid
+        # objects leaving the frame come back on the other side, the objects density stays constant
+        pos = ((start + frameid * velocity) % (width, HEIGHT)).astype(int)
+        tse.objects = {i: pos[i] for i in range(n_objects)}
+        if indexed:
+            count_classes_indexed(counters, index, tse.objects, classes)
+        else:
+            for counter in counters:
+                counter.count_class(tse.objects, classes)
+        tse.compute_speed()
+    elapsed = (time.perf_counter() - t0) / n_frames
+    counts = [sorted(counter.counts_classes.items()) for counter in counters]
+    return elapsed, counts, tse.estimated_speed
+
+
+def main():
+    print("{:>8} {:>12} {:>14} {:>14}".format("lines", "frame width", "brute (ms)", "indexed (ms)"))
+    for n_lines in [2, 10, 50, 100, 200]:
+        t_brute, counts_brute, speed_brute = run(n_lines, indexed=False)
+        t_index, counts_index, speed_index = run(n_lines, indexed=True)
+        assert counts_brute == counts_index and speed_brute == speed_index, 'indexed results differ'
+        print("{:>8} {:>12} {:>14.2f} {:>14.2f}".format(n_lines, n_lines * TILE_WIDTH, t_brute * 1000,
+                                                       t_index * 1000))
+
+
+if __name__ == "__main__":
+    main()
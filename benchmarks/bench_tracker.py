@@ -0,0 +1,76 @@
+#! /usr/bin/env python3
+# coding: utf-8
+"""Per-frame cost of the CentroidTracker association as the number of tracked objects grows,
+with the dense distance matrix and with the gated KD-tree search.
+
+usage : python benchmarks/bench_tracker.py
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from centroid_tracker import CentroidTracker
+
+HEIGHT, WIDTH = 1080, 1920
+
+
+def scene(n_objects, n_frames, rng):
+    """Yields the bounding boxes of every frame of a dense scene : objects moving up to 8 pixels per frame,
+    10% missed detections and a few false detections"""
+    # the scene is stretched so that the density stays the one of a congested highway
+    side = np.sqrt(n_objects / 200.)
+    start = rng.uniform((0, 0), (WIDTH * side, HEIGHT * side), size=(n_objects, 2))
+    velocity = rng.uniform(-8, 8, size=(n_objects, 2))
+    for frameid in range(n_frames):
+        pos = start + frameid * velocity + rng.normal(0, 1, size=(n_objects, 2))
+        pos = pos[rng.random_sample(n_objects) > 0.1]
+        noise = rng.uniform((0, 0), (WIDTH * side, HEIGHT * side), size=(max(1, n_objects // 100), 2))
+        pos = np.concatenate([pos, noise])
+        yield [(x - 20, y - 15, x + 20, y + 15) for x, y in pos]
+
+
+def run(n_objects, n_frames, max_distance, dense_max_pairs):
+    rng = np.random.RandomState(0)
+    frames = list(scene(n_objects, n_frames, rng))
+    ct = CentroidTracker(maxDisappeared=8, maxDistance=max_distance, denseMaxPairs=dense_max_pairs)
+
+    t0 = time.perf_counter()
+    for rects in frames:
+        ct.update(rects)
+    elapsed = (time.perf_counter() - t0) / n_frames
+    return elapsed, ct.nextObjectID, dict(ct.objects)
+
+
+def main():
+    n_frames, max_distance, n_objects_list = get_args()
+    print("{:>8} {:>12} {:>12} {:>12}".format("objects", "dense (ms)", "kdtree (ms)", "kdtree/obj"))
+    for n_objects in n_objects_list:
+        t_dense, n_dense, objects_dense = run(n_objects, n_frames, max_distance, dense_max_pairs=np.inf)
+        t_tree, n_tree, objects_tree = run(n_objects, n_frames, max_distance, dense_max_pairs=0)
+        assert n_dense == n_tree and objects_dense.keys() == objects_tree.keys() and \
+            all((objects_dense[k] == objects_tree[k]).all() for k in objects_dense), 'KD-tree results differ'
+        print("{:>8} {:>12.2f} {:>12.2f} {:>10.2f}us".format(n_objects, t_dense * 1000, t_tree * 1000,
+                                                           t_tree / n_objects * 1e6))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Benchmark the dense and KD-tree tracker associations')
+    parser.add_argument('--frames', dest='n_frames', type=int, default=20,
+                        help='Number of frames per run')
+    parser.add_argument('--max-distance', dest='max_distance', type=float, default=30,
+                        help='Maximum displacement in pixels between two frames')
+    parser.add_argument('--objects', dest='n_objects', type=int, nargs='+',
+                        default=[20, 50, 100, 200, 500, 1000, 2000, 5000],
+                        help='Numbers of objects of the scenes')
+    args = parser.parse_args()
+    return args.n_frames, args.max_distance, args.n_objects
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,12 @@
 
 # import the necessary packages
 from scipy.spatial import distance as dist
+from scipy.spatial import cKDTree
 from collections import OrderedDict
 import numpy as np
 
 class CentroidTracker():
-	def __init__(self, maxDisappeared=50):
+	def __init__(self, maxDisappeared=50, maxDistance=None, denseMaxPairs=40000):
 		# initialize the next unique object ID along with two ordered
 		# dictionaries used to keep track of mapping a given object
 		# ID to its centroid and number of consecutive frames it has
@@ -20,6 +21,14 @@ class CentroidTracker():
 		# need to deregister the object from tracking
 		self.maxDisappeared = maxDisappeared
 
+		# store the maximum distance (in pixels) a centroid can move
+		# between two frames to be matched, None disables the gating.
+		# When gating, the matches are searched in a KD-tree of the
+		# input centroids as soon as the number of (object, input)
+		# pairs is greater than denseMaxPairs
+		self.maxDistance = maxDistance
+		self.denseMaxPairs = denseMaxPairs
+
 	def register(self, centroid):
 		# when registering an object we use the next available object
 		# ID to store the centroid
@@ -39,7 +48,7 @@ class CentroidTracker():
 		if len(rects) == 0:
 			# loop over any existing tracked objects and mark them
 			# as disappeared
-			for objectID in self.disappeared.keys():
+			for objectID in list(self.disappeared.keys()):
 				self.disappeared[objectID] += 1
 
 				# if we have reached a maximum number of consecutive
@@ -76,23 +85,13 @@ class CentroidTracker():
 			objectIDs = list(self.objects.keys())
 			objectCentroids = list(self.objects.values())
 
-			# compute the distance between each pair of object
-			# centroids and input centroids, respectively -- our
-			# goal will be to match an input centroid to an existing
-			# object centroid
-			D = dist.cdist(np.array(objectCentroids), inputCentroids)
-
-			# in order to perform this matching we must (1) find the
-			# smallest value in each row and then (2) sort the row
-			# indexes based on their minimum values so that the row
-			# with the smallest value as at the *front* of the index
-			# list
-			rows = D.min(axis=1).argsort()
-
-			# next, we perform a similar process on the columns by
-			# finding the smallest value in each column and then
-			# sorting using the previously computed row index list
-			cols = D.argmin(axis=1)[rows]
+			# match the object centroids to the input centroids, with
+			# the sparse KD-tree search when there are many pairs
+			if self.maxDistance is not None and \
+				len(objectCentroids) * len(inputCentroids) > self.denseMaxPairs:
+				(rows, cols) = self._match_sparse(objectCentroids, inputCentroids)
+			else:
+				(rows, cols) = self._match_dense(objectCentroids, inputCentroids)
 
 			# in order to determine if we need to update, register,
 			# or deregister an object we need to keep track of which
@@ -123,26 +122,28 @@ class CentroidTracker():
 
 			# compute both the row and column index we have NOT yet
 			# examined
-			unusedRows = set(range(0, D.shape[0])).difference(usedRows)
-			unusedCols = set(range(0, D.shape[1])).difference(usedCols)
+			unusedRows = set(range(0, len(objectCentroids))).difference(usedRows)
+			unusedCols = set(range(0, len(inputCentroids))).difference(usedCols)
+
+			# with the gating, objects can be left unmatched while
+			# input centroids are left unused, so we both age the
+			# unused objects and register the unused input centroids
+			if self.maxDistance is not None:
+				for row in unusedRows:
+					self._mark_disappeared(objectIDs[row])
+				for col in unusedCols:
+					self.register(inputCentroids[col])
 
 			# in the event that the number of object centroids is
 			# equal or greater than the number of input centroids
 			# we need to check and see if some of these objects have
 			# potentially disappeared
-			if D.shape[0] >= D.shape[1]:
+			elif len(objectCentroids) >= len(inputCentroids):
 				# loop over the unused row indexes
 				for row in unusedRows:
 					# grab the object ID for the corresponding row
 					# index and increment the disappeared counter
-					objectID = objectIDs[row]
-					self.disappeared[objectID] += 1
-
-					# check to see if the number of consecutive
-					# frames the object has been marked "disappeared"
-					# for warrants deregistering the object
-					if self.disappeared[objectID] > self.maxDisappeared:
-						self.deregister(objectID)
+					self._mark_disappeared(objectIDs[row])
 
 			# otherwise, if the number of input centroids is greater
 			# than the number of existing object centroids we need to
@@ -152,4 +153,74 @@ class CentroidTracker():
 					self.register(inputCentroids[col])
 
 		# return the set of trackable objects
-		return self.objects
\ No newline at end of file
+		return self.objects
+
+	def _mark_disappeared(self, objectID):
+		# increment the disappeared counter of the object
+		self.disappeared[objectID] += 1
+
+		# check to see if the number of consecutive
+		# frames the object has been marked "disappeared"
+		# for warrants deregistering the object
+		if self.disappeared[objectID] > self.maxDisappeared:
+			self.deregister(objectID)
+
+	def _match_dense(self, objectCentroids, inputCentroids):
+		# compute the distance between each pair of object
+		# centroids and input centroids, respectively -- our
+		# goal will be to match an input centroid to an existing
+		# object centroid
+		D = dist.cdist(np.array(objectCentroids), inputCentroids)
+
+		# in order to perform this matching we must (1) find the
+		# smallest value in each row and then (2) sort the row
+		# indexes based on their minimum values so that the row
+		# with the smallest value as at the *front* of the index
+		# list (stable, so that ties are in the same order as in
+		# the sparse matching)
+		rows = D.min(axis=1).argsort(kind="stable")
+
+		# next, we perform a similar process on the columns by
+		# finding the smallest value in each column and then
+		# sorting using the previously computed row index list
+		cols = D.argmin(axis=1)[rows]
+
+		# drop the matches farther than the maximum distance
+		if self.maxDistance is not None:
+			keep = D[rows, cols] <= self.maxDistance
+			(rows, cols) = (rows[keep], cols[keep])
+
+		return (rows, cols)
+
+	def _match_sparse(self, objectCentroids, inputCentroids):
+		# only the pairs closer than the maximum distance are
+		# computed, with a radius query between the KD-trees of
+		# the object centroids and of the input centroids
+		pairs = cKDTree(np.array(objectCentroids)).sparse_distance_matrix(
+			cKDTree(inputCentroids), self.maxDistance, output_type="ndarray")
+
+		# as in the dense matching, keep the closest input centroid
+		# of each object (the smallest column index on ties), then
+		# sort the objects by the distance to their closest centroid
+		order = np.lexsort((pairs["j"], pairs["v"], pairs["i"]))
+		pairs = pairs[order]
+		(_, first) = np.unique(pairs["i"], return_index=True)
+		pairs = pairs[first]
+		order = pairs["v"].argsort(kind="stable")
+
+		return (pairs["i"][order], pairs["j"][order])
+
+	def get_state(self):
+		# return a copy of the tracker state that can be pickled
+		# and later given back to set_state
+		return dict(nextObjectID=self.nextObjectID,
+			objects=OrderedDict(self.objects),
+			disappeared=OrderedDict(self.disappeared),
+			maxDisappeared=self.maxDisappeared)
+
+	def set_state(self, state):
+		# restore the tracker state saved by get_state
+		self.nextObjectID = state["nextObjectID"]
+		self.objects = OrderedDict(state["objects"])
+		self.disappeared = OrderedDict(state["disappeared"])
+		self.maxDisappeared = state["maxDisappeared"]
@@ -30,6 +30,7 @@ class Control_zone:
         ckzn_d (int): distance in meters between the start and the end line of control zone
         col (tuple of int): RGB color of the control zone
         draw_loc (str): location of the average speed of the control zone ['top-left','bottom-left','bottom-right','top-right']
+        y_shift (float): y offset of the image in the input video (cropped frame cache), see utils.line_band
 
     Attributes:
         height (int): image height in pixels
@@ -40,10 +41,11 @@ class Control_zone:
         ckzn_d (int): distance in meters between the start and the end line of control zone
         col (tuple of int): RGB color of the control zone
         draw_loc (str): location of the average speed of the control zone ['top-left','bottom-left','bottom-right','top-right']
+        y_shift (float): y offset of the image in the input video
 
     """
 
-    def __init__(self, idczone, height, width, x1y1x2y2, x3y3x4y4, ckzn_d, speedlimit, col, draw_loc):
+    def __init__(self, idczone, height, width, x1y1x2y2, x3y3x4y4, ckzn_d, speedlimit, col, draw_loc, y_shift=0):
         self.height = height
         self.width = width
         self.border1 = x1y1x2y2
@@ -53,6 +55,7 @@ class Control_zone:
         self.idczone = idczone
         self.col = col
         self.draw_loc = draw_loc
+        self.y_shift = y_shift
         self._construct_zone()
 
     def _construct_zone(self):
@@ -101,7 +104,7 @@ class Control_zone:
             bool : True if the projected point is in start line of the control zone
                    ,False otherwise
         """
-        return is_crossing_line(xy[0], xy[1], self.border1, tresh=0.015)
+        return is_crossing_line(xy[0], xy[1], self.border1, tresh=0.015, y_shift=self.y_shift)
 
     def exiting_zone(self, xy):
         """Checks if the point (x,y) is in the exiting zone (start line)
@@ -113,19 +116,42 @@ class Control_zone:
             bool : True if the projected point is in end line of the control zone
                    ,False otherwise
         """
-        return is_crossing_line(xy[0], xy[1], self.border2, tresh=0.015)
+        return is_crossing_line(xy[0], xy[1], self.border2, tresh=0.015, y_shift=self.y_shift)
 
-    def display_zone(self, img):
+    def start_band(self):
+        """Returns the small polygone around the start line used by entering_zone
+        """
+        return line_band(self.border1, tresh=0.015, y_shift=self.y_shift)
+
+    def exit_band(self):
+        """Returns the small polygone around the end line used by exiting_zone
+        """
+        return line_band(self.border2, tresh=0.015, y_shift=self.y_shift)
+
+    def display_zone(self, img, pool=None):
         """Displays the control zone on the input image
+        Note :
+              the zone is blended in place, only on the bounding box of the zone
         Args:
             img (numpy 2D array): input image
+            pool (FramePool object): optional pool of the overlay buffer
         Returns:
-            image_new (numpy 2D array): new image with the drawn control zone
+            image_new (numpy 2D array): the input image with the drawn control zone
         """
         alpha = 0.4
-        overlay = img.copy()
         pts = np.array([self.border1[0], self.border1[1], self.border2[0], self.border2[1]], np.int32)
-        pts = pts.reshape((-1, 1, 2))
+        x1, y1 = np.maximum(pts.min(axis=0), 0)
+        x2, y2 = np.minimum(pts.max(axis=0) + 1, (img.shape[1], img.shape[0]))
+        if x2 <= x1 or y2 <= y1:
+            return img
+
+        roi = img[y1:y2, x1:x2]
+        if pool is not None:
+            overlay = pool.get('czone{}'.format(self.idczone), roi.shape, roi.dtype)
+        else:
+            overlay = np.empty_like(roi)
+        np.copyto(overlay, roi)
+        pts = (pts - (x1, y1)).reshape((-1, 1, 2))
         cv2.fillPoly(img=overlay, pts=[pts], color=self.col)
-        image_new = cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0)
-        return image_new
+        cv2.addWeighted(overlay, alpha, roi, 1 - alpha, 0, dst=roi)
+        return img
@@ -1,6 +1,8 @@
 #! /usr/bin/env python3
 # coding: utf-8
 
+import numpy as np
+
 from utils import *
 
 
@@ -9,28 +11,32 @@ class Counter:
 
     Args:
         border (tuple of int): list of two (x,y) positions that defines the counting line ([(x1,y1,x2,y2)])
-        cls (list of str): list of objects classes you want to be counted (yolov3 classes)
+        cls (list of str): list of objects classes you want to be counted (yolov3 classes),
+                           it is the class table : class ids are the indexes of their names in it
         color (tuple of int): RGB color of the counter
         draw_loc (str): location of the counter in the image
+        y_shift (float): y offset of the image in the input video (cropped frame cache), see utils.line_band
 
     Attributes:
         border (tuple of int): list of two (x,y) positions that defines the counting line ([(x1,y1,x2,y2)])
         cls (list of str): list of objects classes you want to be counted (yolov3 classes)
         color (tuple of int): RGB color of the counter
         draw_loc (str): location of the counter in the image
+        y_shift (float): y offset of the image in the input video
         objects_seen (list): list of id elements already counted
         is_crossing (bool): is any element currently crossing the border
-        counts_classes (dict): dictionnary of classes and their counts
+        counts (numpy array): counts indexed by class id
 
     """
 
-    def __init__(self, border, cls, color, draw_loc):
+    def __init__(self, border, cls, color, draw_loc, y_shift=0):
         self.color = color
         self.cls = cls
-        self.counts_classes = dict(zip(list(cls), [0] * len(cls)))
+        self.counts = np.zeros(len(cls), dtype=np.int64)
         self.objects_seen = []
         self.border = border
         self.draw_loc = draw_loc
+        self.y_shift = y_shift
         self.is_crossing = False
 
     def count_class(self, objects, mapped_centroid_classes):
@@ -41,25 +47,55 @@ class Counter:
             objects (dict): dictionnary of centroid coordinated
                             of tracked elements in the image (ie : {0: [250,470],1: [410,520]} )
             mapped_centroid_classes (dict): dictionnary of tracked elements
-                                            and their detected classes
-                                            (ie {0:'car',1: 'car',2:'truck'} )
+                                            and their detected class ids
+                                            (ie {0: 0, 1: 0, 2: 1} )
 
         Returns:
-            self.counts_classe (dict): dictionnary of the counted classes (ie {'car': 43, 'truck': 5, 'motorbike': 0})
+            self.counts (numpy array): counts indexed by class id (ie [43, 5, 0])
         """
         self.is_crossing = False
         x1, y1, x2, y2 = self.border
         for (objectID, centroid) in objects.items():
-            if is_crossing_line(centroid[0], centroid[1], ((x1, y1), (x2, y2))):
-                if objectID not in self.objects_seen:
-                    cls = mapped_centroid_classes[objectID]
-                    if cls in self.counts_classes.keys():
-                        self.counts_classes[cls] += 1
-                    else:
-                        self.counts_classes[cls] = 1
-                    self.objects_seen.append(objectID)
-                    self.is_crossing = True
-        return self.counts_classes
+            if is_crossing_line(centroid[0], centroid[1], ((x1, y1), (x2, y2)), y_shift=self.y_shift):
+                self.count_object(objectID, mapped_centroid_classes[objectID])
+        return self.counts
+
+    @property
+    def counts_classes(self):
+        """Returns the dictionnary of the counted classes names and their counts (ie {'car': 43, 'truck': 5})
+        """
+        return dict(zip(self.cls, self.counts.tolist()))
+
+    def count_object(self, objectID, cls):
+        """Counts an element crossing the border if it has not been counted yet
+
+        Args:
+            objectID (int): id of the tracked element
+            cls (int): detected class id of the tracked element
+        """
+        if objectID not in self.objects_seen:
+            self.counts[cls] += 1
+            self.objects_seen.append(objectID)
+            self.is_crossing = True
+
+    def get_state(self):
+        """Returns a copy of the counting state (counts, objects_seen and is_crossing)
+        """
+        return dict(counts=self.counts.copy(), objects_seen=list(self.objects_seen),
+                    is_crossing=self.is_crossing)
+
+    def set_state(self, state):
+        """Restores the counting state saved by get_state
+        """
+        self.counts = np.array(state['counts'], dtype=np.int64)
+        self.objects_seen = list(state['objects_seen'])
+        self.is_crossing = state['is_crossing']
+
+    def band(self):
+        """Returns the small polygone around the counting line in which elements are counted
+        """
+        x1, y1, x2, y2 = self.border
+        return line_band(((x1, y1), (x2, y2)), y_shift=self.y_shift)
 
     def count_display(self, img, icons, draw_line=True):
         """Displays out the counter on the input image
@@ -80,7 +116,7 @@ class Counter:
             c_index_end = (c_index_start + icons[obj]["w"])
 
             img[r_index_start:r_index_end, c_index_start:c_index_end] = icons[obj]["icon"]
-            cv2.putText(img, "{}".format(self.counts_classes[obj]), (
+            cv2.putText(img, "{}".format(self.counts[num_o]), (
                 abs(min(0, offset_c) * shape[1]) + c_index_end + 5,
                 abs((min(0, offset_r) * img.shape[0])) + r_index_end),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.5, self.color, 2)
@@ -88,3 +124,21 @@ class Counter:
         if draw_line:
             cv2.line(img, self.border[:2], self.border[2:],
                      crossing_color(self.color, self.is_crossing), 3)
+
+
+def count_classes_indexed(counters, index, objects, mapped_centroid_classes):
+    """Same as calling Counter.count_class for each counter,
+    but each centroid is only tested against the counters lines of its spatial index cell
+
+    Args:
+        counters (list of Counter object): counters registered in the index
+        index (SpatialIndex object): spatial index of the counters lines
+        objects (dict): dictionnary of centroid coordinated of tracked elements in the image
+        mapped_centroid_classes (dict): dictionnary of tracked elements and their detected class ids
+    """
+    for counter in counters:
+        counter.is_crossing = False
+    for (objectID, centroid) in objects.items():
+        for owner, tag in index.query(centroid):
+            if tag == 'border':
+                owner.count_object(objectID, mapped_centroid_classes[objectID])
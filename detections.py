@@ -0,0 +1,69 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import numpy as np
+
+# the class of a detection is the index of its name in the class table (the classes list given to the detector,
+# the counters and the track log), names are only used to display and export the counts
+DETECTION_DTYPE = np.dtype([('x1', np.int32), ('y1', np.int32), ('x2', np.int32), ('y2', np.int32),
+                            ('conf', np.float32), ('cls', np.int16)])
+
+
+def empty_detections():
+    """Returns an empty detections structured array
+    """
+    return np.empty(0, dtype=DETECTION_DTYPE)
+
+
+def boxes(detections):
+    """Returns the (N, 4) x1, y1, x2, y2 bounding boxes of the detections
+    """
+    return np.stack([detections['x1'], detections['y1'], detections['x2'], detections['y2']], axis=1)
+
+
+def centroids(detections):
+    """Returns the (N, 2) centroids of the detections bounding boxes
+    """
+    return np.stack([(detections['x1'] + detections['x2']) / 2, (detections['y1'] + detections['y2']) / 2], axis=1)
+
+
+def filter_detections(detections, min_conf):
+    """Returns the detections with a confidence greater or equal to min_conf (in percent)
+    """
+    return detections[detections['conf'] >= min_conf]
+
+
+def nms(detections, iou_threshold=0.45):
+    """Per-class non maximum suppression : keeps the most confident detection of each group of same class
+    detections overlapping more than iou_threshold
+
+    Note : boxes of each class are shifted to their own area of the plane, so that a single suppression pass
+           never compares two classes.
+
+    Args:
+        detections (numpy structured array): detections of DETECTION_DTYPE
+        iou_threshold (float): maximum intersection over union of two kept detections of the same class
+    Returns:
+        detections (numpy structured array): kept detections, by decreasing confidence
+    """
+    if len(detections) < 2:
+        return detections
+    xyxy = boxes(detections).astype(np.float64)
+    # coordinates from 0 (boxes can be negative), so that the class areas never overlap
+    xyxy -= xyxy.min()
+    xyxy += (detections['cls'].astype(np.float64) * (xyxy.max() + 1))[:, np.newaxis]
+    x1, y1, x2, y2 = xyxy.T
+    areas = (x2 - x1) * (y2 - y1)
+
+    order = np.argsort(-detections['conf'], kind='stable')
+    keep = []
+    while len(order) > 0:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return detections[keep]
+
@@ -2,8 +2,11 @@
 # coding: utf-8
 
 import cv2
+import numpy as np
 from imageai.Detection import ObjectDetection
 
+from detections import DETECTION_DTYPE, filter_detections, nms
+
 
 class YOLOV3Detector:
     """YOLOV3 detector class
@@ -11,19 +14,26 @@ class YOLOV3Detector:
     Note : This class is based on the usage of imageai python package
 
     Args:
-        cls (list of str): list of coco classes to detect (i.e ['car','truck','motorcycle'])
+        cls (list of str): list of coco classes to detect (i.e ['car','truck','motorcycle']),
+                           it is the class table : detections classes are the indexes of their names in it
         wieghts_path (str): path to the yolov3 coco path
+        min_conf (float): minimum confidence of the detections in percent
+        nms_iou (float): maximum intersection over union of two detections of the same class
 
     Attributes:
         cls (list of str): list of coco classes to detect
         wieghts_path (str): path to the yolov3 coco path
         detector (object): ObjectDetection class object
         custom_objects (dict):  dictionnary of coco customs objects to detect (i.e {'car':True,'Truck':True} )
+        min_conf (float): minimum confidence of the detections in percent
+        nms_iou (float): maximum intersection over union of two detections of the same class
     """
 
-    def __init__(self, cls, weights_path):
+    def __init__(self, cls, weights_path, min_conf=60, nms_iou=0.45):
         self.cls = cls
         self.weights_path = weights_path
+        self.min_conf = min_conf
+        self.nms_iou = nms_iou
         self.detector = ObjectDetection()
         self._load_model()
         self.custom_objects = self.detector.CustomObjects(**dict(zip(self.cls, [True] * len(self.cls))))
@@ -36,32 +46,32 @@ class YOLOV3Detector:
         self.detector.setModelPath(self.weights_path)
         self.detector.loadModel()
 
-    def detect(self, img):
+    def detect(self, img, pool=None):
         """detect method performs class detection
 
         Args:
             img (numpy 2D array): input image
+            pool (FramePool object): optional pool of the color conversion buffer
 
         Returns:
             result (numpy 2D array) : the input image with detected objects drawn
-            detections (list of tuple): list of dictionnary of the detected objects
-                                        (i.e [{'name': 'truck', 'percentage_probability': 51.10,
-                                        'box_points': [829, 485, 904, 552]},
-                                        {'name': 'truck', 'percentage_probability': 61.18,
-                                        'box_points': [1171, 796, 1357, 935]}]
-
+            detections (numpy structured array): detected objects of detections.DETECTION_DTYPE
+                                                 (i.e [(829, 485, 904, 552, 61.1, 1), (1171, 796, 1357, 935, 75.2, 0)])
 
         """
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        dst = pool.get('detector_rgb', img.shape, img.dtype) if pool is not None else None
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=dst)
         # Object detection
         result_img, detections = self.detector.detectCustomObjectsFromImage(custom_objects=self.custom_objects,
                                                                             input_image=img,
                                                                             input_type='array',
                                                                             output_type="array",
-                                                                            minimum_percentage_probability=60)
-        result_img = cv2.cvtColor(result_img,cv2.COLOR_RGB2BGR)
+                                                                            minimum_percentage_probability=self.min_conf)
+        # the annotated image belongs to us, it is converted in place
+        result_img = cv2.cvtColor(result_img, cv2.COLOR_RGB2BGR, dst=result_img)
 
-        detections = reformat_detection(detections)
+        detections = reformat_detection(detections, self.cls)
+        detections = nms(filter_detections(detections, self.min_conf), self.nms_iou)
 
         return result_img, detections
 
@@ -71,22 +81,19 @@ class YOLOV3Detector:
         self.detector.sess.close()
 
 
-def reformat_detection(detections):
+def reformat_detection(detections, classes):
     """
     Reformat the detections
     Args:
         detections : detections from ObjectDetection object class instance
+                     (i.e [{'name': 'truck', 'percentage_probability': 51.10, 'box_points': [829, 485, 904, 552]}])
+        classes (list of str): class table, objects of other classes are dropped
 
     Returns:
-        res (list of tuples): contains the detected object class confidence and bounding boxes coordinates
+        res (numpy structured array): detected objects bounding boxes, confidence and class id
+                                      of detections.DETECTION_DTYPE
     """
-    res = []
-    for detection in detections:
-        x1 = detection['box_points'][0]
-        y1 = detection['box_points'][1]
-        x2 = detection['box_points'][2]
-        y2 = detection['box_points'][3]
-        cls = detection['name']
-        conf = detection['percentage_probability']
-        res.append((x1, y1, x2, y2, conf, cls))
-    return res
+    class_ids = {name: i for i, name in enumerate(classes)}
+    return np.array([tuple(detection['box_points'][:4]) +
+                     (detection['percentage_probability'], class_ids[detection['name']])
+                     for detection in detections if detection['name'] in class_ids], dtype=DETECTION_DTYPE)
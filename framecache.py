@@ -0,0 +1,224 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import json
+import os
+import struct
+
+import cv2
+import numpy as np
+
+HEADER_FORMAT = '<4sIQIIIddIII'
+HEADER_SIZE = 4096
+MAGIC = b'TCFC'
+VERSION = 2
+
+
+def source_info(video_path, scale=1., crop=None):
+    """Returns the description of the input video and of the preprocessing of a frame store
+
+    Args:
+        video_path (str): path of the input video
+        scale (float): resize factor applied to the frames (after the crop)
+        crop (tuple of int): optional (x1, y1, x2, y2) region of interest in pixels of the input video
+    Returns:
+        source (dict): path, size and modification time of the video, scale and crop
+    """
+    stat = os.stat(video_path)
+    return dict(path=os.path.abspath(video_path), size=stat.st_size, mtime=stat.st_mtime, scale=float(scale),
+                crop=[int(v) for v in crop] if crop is not None else None)
+
+
+def cache_matches(cache_path, video_path, scale=1., crop=None):
+    """Checks that a frame store was built from the video with the same scale and crop
+
+    Args:
+        cache_path (str): path of the frame store
+        video_path (str): path of the input video
+        scale (float): resize factor applied to the frames (after the crop)
+        crop (tuple of int): optional (x1, y1, x2, y2) region of interest in pixels of the input video
+    Returns:
+        bool : True if the frame store can be reused, False otherwise (missing, older version or other source)
+    """
+    if not os.path.exists(cache_path) or not os.path.exists(video_path):
+        return False
+    try:
+        source = read_header(cache_path)[-1]
+    except IOError:
+        return False
+    return source == source_info(video_path, scale, crop)
+
+
+def read_header(cache_path):
+    """Reads the header of a frame store
+
+    Returns:
+        n_frames (int): number of frames
+        shape (tuple of int): (height, width, channels) frames shape
+        fps (float): frame rate of the video
+        scale (float): resize factor applied to the frames of the input video
+        offset (tuple of int): (x, y) crop offset in pixels of the input video
+        source (dict): description of the input video (source_info)
+    """
+    with open(cache_path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < struct.calcsize(HEADER_FORMAT):
+        raise IOError("File {} is not a frame cache (version {})".format(cache_path, VERSION))
+    magic, version, n_frames, height, width, channels, fps, scale, x, y, source_size = struct.unpack_from(
+        HEADER_FORMAT, header)
+    if magic != MAGIC or version != VERSION:
+        raise IOError("File {} is not a frame cache (version {})".format(cache_path, VERSION))
+    start = struct.calcsize(HEADER_FORMAT)
+    source = json.loads(header[start:start + source_size].decode())
+    return n_frames, (height, width, channels), fps, scale, (x, y), source
+
+
+def build_frame_cache(video_path, cache_path, scale=1., crop=None):
+    """Decodes a video once into a raw uint8 frame store
+
+    Note : the store is a 4096 bytes header (number of frames, shape, fps, scale, crop offset and the source_info
+           of the video checked by cache_matches) followed by the frames, so it can be memory-mapped by
+           CachedVideoCapture.
+
+    Args:
+        video_path (str): path of the input video
+        cache_path (str): path of the frame store
+        scale (float): resize factor applied to the frames (after the crop)
+        crop (tuple of int): optional (x1, y1, x2, y2) region of interest in pixels of the input video
+    Returns:
+        n_frames (int): number of frames written
+    """
+    video_capture = cv2.VideoCapture(video_path)
+    if not video_capture.isOpened():
+        raise IOError("Cannot open video {}".format(video_path))
+    fps = video_capture.get(cv2.CAP_PROP_FPS)
+    x1, y1 = (crop[0], crop[1]) if crop is not None else (0, 0)
+    source = json.dumps(source_info(video_path, scale, crop)).encode()
+    if struct.calcsize(HEADER_FORMAT) + len(source) > HEADER_SIZE:
+        raise ValueError("Video path {} is too long for the frame cache header".format(video_path))
+
+    n_frames, shape = 0, None
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER_SIZE)
+        while True:
+            ret, frame = video_capture.read()
+            if not ret:
+                break
+            if crop is not None:
+                frame = frame[crop[1]:crop[3], crop[0]:crop[2]]
+            if scale != 1.:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            shape = frame.shape
+            f.write(np.ascontiguousarray(frame).tobytes())
+            n_frames += 1
+
+        if shape is None:
+            raise IOError("No frame decoded from {}".format(video_path))
+        f.seek(0)
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, n_frames, shape[0], shape[1], shape[2], fps, scale,
+                            x1, y1, len(source)))
+        f.write(source)
+    video_capture.release()
+    os.replace(tmp_path, cache_path)
+    return n_frames
+
+
+class CachedVideoCapture:
+    """CachedVideoCapture class reads a frame store built by build_frame_cache with the cv2.VideoCapture interface
+    used by main.py and TrackerSpeedEstimator (read, get, set, isOpened, release)
+
+    Note : frames are memory-mapped, frame(i) gives zero-copy read-only access to any frame,
+           read() copies the next frame into the given image buffer (or a new array) since the pipeline draws on it.
+
+    Args:
+        cache_path (str): path of the frame store
+
+    Attributes:
+        n_frames (int): number of frames
+        height (int): frames height in pixels
+        width (int): frames width in pixels
+        fps (float): frame rate of the video
+        scale (float): resize factor applied to the frames of the input video
+        offset (tuple of int): (x, y) crop offset in pixels of the input video
+        source (dict): description of the input video and of the preprocessing (source_info)
+        frames (numpy memmap): (n_frames, height, width, channels) frames
+        pos (int): index of the next frame to read
+    """
+
+    def __init__(self, cache_path):
+        self.n_frames, shape, self.fps, self.scale, self.offset, self.source = read_header(cache_path)
+        self.height, self.width, channels = shape
+        self.frames = np.memmap(cache_path, dtype=np.uint8, mode='r', offset=HEADER_SIZE,
+                                shape=(self.n_frames, self.height, self.width, channels))
+        self.pos = 0
+        self._opened = True
+
+    def frame(self, i):
+        """Returns the frame i (read-only view on the page cache)
+        """
+        return self.frames[i]
+
+    def read(self, image=None):
+        """Same as cv2.VideoCapture.read
+
+        Args:
+            image (numpy 2D array): optional buffer the frame is copied into
+        Returns:
+            ret (bool): False at the end of the video
+            frame (numpy 2D array): the frame
+        """
+        if not self._opened or self.pos >= self.n_frames:
+            return False, None
+        frame = self.frames[self.pos]
+        self.pos += 1
+        if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+            np.copyto(image, frame)
+            return True, image
+        return True, np.array(frame)
+
+    def get(self, prop):
+        """Same as cv2.VideoCapture.get for the frame size, fps, frame count and frame position properties
+        """
+        values = {cv2.CAP_PROP_FRAME_HEIGHT: self.height, cv2.CAP_PROP_FRAME_WIDTH: self.width,
+                  cv2.CAP_PROP_FPS: self.fps, cv2.CAP_PROP_FRAME_COUNT: self.n_frames,
+                  cv2.CAP_PROP_POS_FRAMES: self.pos}
+        return float(values.get(prop, 0))
+
+    def set(self, prop, value):
+        """Same as cv2.VideoCapture.set, only the frame position can be set
+        """
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.pos = min(max(int(value), 0), self.n_frames)
+        return True
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        self._opened = False
+
+    def map_point(self, x, y):
+        """Maps a point of the input video to the cached frames coordinates (crop and scale)
+        """
+        return int(round((x - self.offset[0]) * self.scale)), int(round((y - self.offset[1]) * self.scale))
+
+
+def map_geometry(video_capture, counters_ini, czones_ini):
+    """Maps the config.ini counters lines and control zones lines to the cached frames coordinates
+
+    Args:
+        video_capture (CachedVideoCapture object): frame cache
+        counters_ini (list of tuple int): x1, y1, x2, y2 counters lines (Config.parse_counters)
+        czones_ini (list of dict): control zones parameters (Config.parse_czones)
+    Returns:
+        counters_ini (list of tuple int): mapped counters lines
+        czones_ini (list of dict): control zones parameters with mapped start and exit lines
+    """
+    counters_ini = [video_capture.map_point(x1, y1) + video_capture.map_point(x2, y2)
+                    for x1, y1, x2, y2 in counters_ini]
+    czones_ini = [dict(czone_ini, start=tuple(video_capture.map_point(*pt) for pt in czone_ini['start']),
+                       exit=tuple(video_capture.map_point(*pt) for pt in czone_ini['exit']))
+                  for czone_ini in czones_ini]
+    return counters_ini, czones_ini
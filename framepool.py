@@ -0,0 +1,58 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import cv2
+import numpy as np
+
+
+class FramePool:
+    """FramePool class keeps named reusable numpy buffers so that the frame loop does not allocate full-size images
+
+    Note : a buffer is only valid until the next call asking for the same name, so buffers must not be kept
+           across frames (copy them if needed).
+
+    Attributes:
+        buffers (dict): dictionnary of the buffers names and their numpy arrays
+        n_allocations (int): number of buffers allocated (stays constant once the loop is warm)
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.n_allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        """Returns the buffer of a name, allocated only if it does not exist yet with this shape and type
+
+        Args:
+            name (str): buffer name
+            shape (tuple of int): buffer shape
+            dtype (numpy dtype): buffer type
+        Returns:
+            buf (numpy array): uninitialized buffer
+        """
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[name] = buf
+            self.n_allocations += 1
+        return buf
+
+    def read(self, video_capture, name='frame'):
+        """Reads the next frame of a video into a pooled buffer
+
+        Args:
+            video_capture (opencv object): opencv video iterator
+            name (str): buffer name
+        Returns:
+            ret (bool): False if no frame has been read
+            frame (numpy 2D array): the frame
+        """
+        height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        buf = self.get(name, (height, width, 3))
+        ret, frame = video_capture.read(image=buf)
+        if ret and frame is not buf:
+            # the decoder returned another shape, keep its array as the buffer
+            self.buffers[name] = frame
+            self.n_allocations += 1
+        return ret, frame
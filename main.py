@@ -2,61 +2,133 @@
 # coding: utf-8
 
 from controlzone import Control_zone
-from counter import Counter
-from detector import YOLOV3Detector
+from counter import Counter, count_classes_indexed
 from config import Config
+from detections import empty_detections
+from framecache import CachedVideoCapture, build_frame_cache, cache_matches, map_geometry
+from framepool import FramePool
+from motiongate import MotionGate, geometry_roi
+from snapshot import Snapshotter, load_snapshot, restore_snapshot
+from spatialindex import build_index
+from tracklog import TrackLogWriter
 from trackerspeedestimator import TrackerSpeedEstimator
 from utils import *
 import argparse
+import copy
+
+
+R_col = (255, 0, 0)
+G_col = (0, 255, 0)
+B_col = (0, 0, 255)
 
 
 def main():
-    video_path, output_path, yolov3_weights_path = get_args()
+    args = get_args()
 
     config = Config()
-
-    video_capture = cv2.VideoCapture(video_path)
+    counters_ini, czones_ini = config.parse_counters(), config.parse_czones()
+
+    y_shift = 0
+    if args.frame_cache is not None:
+        # decode the video once, the next runs read the raw frames of the memory-mapped cache
+        # (rebuilt if it was built from another video, scale or crop)
+        if not cache_matches(args.frame_cache, args.input_path, scale=args.cache_scale, crop=args.cache_crop):
+            n_frames = build_frame_cache(args.input_path, args.frame_cache, scale=args.cache_scale,
+                                         crop=args.cache_crop)
+            print("Frame cache {} built ({} frames)".format(args.frame_cache, n_frames))
+        video_capture = CachedVideoCapture(args.frame_cache)
+        counters_ini, czones_ini = map_geometry(video_capture, counters_ini, czones_ini)
+        # the counting bands keep the thickness they have on the input video
+        y_shift = video_capture.offset[1] * video_capture.scale
+    else:
+        video_capture = cv2.VideoCapture(args.input_path)
 
     HEIGHT = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
     WIDTH = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
     FPS = int(video_capture.get(cv2.CAP_PROP_FPS))
 
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    out = cv2.VideoWriter(output_path, fourcc, FPS, (WIDTH, HEIGHT))
+    # the annotated video is only written (and the overlays drawn on every frame) when an output path is given
+    out = None
+    if args.output_path is not None:
+        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        out = cv2.VideoWriter(args.output_path, fourcc, FPS, (WIDTH, HEIGHT))
 
     classes = ['car', 'truck', 'motorcycle']
 
-    R_col = (255, 0, 0)
-    G_col = (0, 255, 0)
-    B_col = (0, 0, 255)
+    # BUILD THE COUNTERS AND THE CONTROL ZONES
+    counters = build_counters(counters_ini, classes, y_shift=y_shift)
+    czones = build_czones(czones_ini, HEIGHT, WIDTH, y_shift=y_shift)
 
-    icons = load_icons(classes)
+    # Build the detector (imported here so that run can be used without imageai and tensorflow)
+    from detector import YOLOV3Detector
+    detector = YOLOV3Detector(cls=classes, weights_path=args.weights)
 
-    # Set the counters parameters
-    counters_ini = config.parse_counters()
+    # Serve the statistics and the preview over HTTP (imported here so that the server is only loaded with --serve)
+    server = None
+    if args.serve_port is not None:
+        from previewserver import PreviewServer
+        server = PreviewServer(port=args.serve_port, max_fps=args.preview_fps)
+        print("Preview served at {}".format(server.address))
 
-    # MODIFY THIS DEPENDING ON THE NUMBER OF COUNTERS YOU HAVE SET IN THE config.ini FILE
-    counters_params = [dict(cls=classes, color=R_col, draw_loc='bottom-left'),
-                       dict(cls=classes, color=G_col, draw_loc='bottom-right')]
+    run(video_capture, detector, counters, czones, classes, out=out, show=not args.no_window,
+        motion_gate=args.motion_gate, gate_audit=args.gate_audit, track_log_path=args.track_log,
+        snapshot_path=args.snapshot, snapshot_every=max(1, args.snapshot_every * FPS), resume=args.resume,
+        max_distance=args.max_distance, server=server)
+
+    if server is not None:
+        server.close()
+    detector.close()
+    video_capture.release()
+    cv2.destroyAllWindows()
+    if out is not None:
+        out.release()
+
+
+def build_counters(counters_ini, classes, y_shift=0):
+    """Builds the counters from the config.ini counters lines
+
+    Args:
+        counters_ini (list of tuple int): x1, y1, x2, y2 counters lines (Config.parse_counters)
+        classes (list of str): counted classes
+        y_shift (float): y offset of the frames in the input video (cropped frame cache)
+    Returns:
+        counters (list of Counter object): counters
+    """
+    # Colors and display locations are cycled over the counters set in the config.ini file
+    counters_cols = [R_col, G_col, B_col]
+    counters_locs = ['bottom-left', 'bottom-right', 'top-left', 'top-right']
+    counters_params = [dict(cls=classes, color=counters_cols[i % len(counters_cols)],
+                            draw_loc=counters_locs[i % len(counters_locs)], y_shift=y_shift)
+                       for i in range(len(counters_ini))]
 
-    assert len(counters_params) == len(counters_ini), 'Same number of counters must be in config.ini and main.py '
     for counter_param_main, counter_param_ini in zip(counters_params, counters_ini):
         counter_param_main.update(dict(border=counter_param_ini))
 
-    # BUILD THE COUNTERS
     counters = []
     for counter_params in counters_params:
         counter = Counter(**counter_params)
         counters.append(counter)
+    return counters
+
+
+def build_czones(czones_ini, height, width, y_shift=0):
+    """Builds the control zones from the config.ini control zones
+
+    Args:
+        czones_ini (list of dict): control zones parameters (Config.parse_czones)
+        height (int): image height in pixels
+        width (int): image width in pixels
+        y_shift (float): y offset of the frames in the input video (cropped frame cache)
+    Returns:
+        czones (list of Control_zone object): control zones
+    """
+    # Colors and display locations are cycled over the control zones set in the config.ini file
+    czones_cols = [R_col, G_col, B_col]
+    czones_locs = ['top-right', 'top-left', 'bottom-right', 'bottom-left']
+    czones_params = [dict(height=height, width=width, col=czones_cols[i % len(czones_cols)],
+                          draw_loc=czones_locs[i % len(czones_locs)], y_shift=y_shift)
+                     for i in range(len(czones_ini))]
 
-    # Set the control zones parameters
-    czones_ini = config.parse_czones()
-
-    # MODIFY THIS DEPENDING ON THE NUMBER OF CONTROL ZONES YOU HAVE SET IN THE config.ini FILE
-    czones_params = [dict(height=HEIGHT, width=WIDTH, col=R_col, draw_loc='top-right'),
-                     dict(height=HEIGHT, width=WIDTH, col=G_col, draw_loc='top-left')]
-
-    assert len(counters_params) == len(counters_ini), 'Same number of control zones must be in config.ini and main.py '
     for czone_param_main, czone_param_ini in zip(czones_params, czones_ini):
         czone_param_main.update(dict(idczone=czone_param_ini['id'],
                                      ckzn_d=czone_param_ini['cz_distance'],
@@ -64,72 +136,228 @@ def main():
                                      x1y1x2y2=czone_param_ini['start'],
                                      x3y3x4y4=czone_param_ini['exit']))
 
-    # BUILD THE CONTROL ZONES
     czones = []
     for czone_params in czones_params:
         czone = Control_zone(**czone_params)
         czones.append(czone)
+    return czones
+
+
+def run(video_capture, detector, counters, czones, classes, out=None, show=True, motion_gate=False,
+        gate_audit=False, track_log_path=None, max_disappeared=8, detect_every=1, snapshot_path=None,
+        snapshot_every=1500, resume=False, frame_pool=True, max_distance=None, server=None):
+    """Runs the detection, tracking, counting and speed estimation over the whole video
+
+    Args:
+        video_capture (opencv object): opencv video iterator
+        detector (object): detector with the YOLOV3Detector detect method
+        counters (list of Counter object): counters
+        czones (list of Control_zone object): control zones
+        classes (list of str): counted classes, class table of the detector class ids
+        out (opencv object): opencv video writer of the output video (not written if None)
+        show (bool): display the output video in a window
+        motion_gate (bool): skip the detection on frames without motion around the counters and control zones
+        gate_audit (bool): also run the full detection to report the counts missed by the motion gate
+                           (needs motion_gate)
+        track_log_path (str): directory of the track log (not saved if None)
+        max_disappeared (int): number of frames a tracked object can be missing before being deregistered
+        detect_every (int): the detection runs once every detect_every frames
+        snapshot_path (str): path of the pipeline state snapshot file (no snapshot if None)
+        snapshot_every (int): number of frames between two snapshots
+        resume (bool): restore the snapshot (if it exists) and resume the video from the snapshot frame
+        frame_pool (bool): read and draw the frames in reusable buffers instead of allocating new images
+        max_distance (float): maximum displacement in pixels of a tracked object between two frames (not gated if None)
+        server (PreviewServer object): HTTP server of the statistics and of the preview (not served if None)
+    Returns:
+        trackerspeed (TrackerSpeedEstimator object): tracker and speed estimator at the end of the video
+    """
+    if gate_audit and not motion_gate:
+        raise ValueError("gate_audit needs motion_gate : the audit measures the counts missed by the motion gate")
+
+    HEIGHT = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    WIDTH = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    FPS = int(video_capture.get(cv2.CAP_PROP_FPS))
+
+    icons = load_icons(classes)
 
-    # Build the detector
-    detector = YOLOV3Detector(cls=classes, weights_path=yolov3_weights_path)
+    # Build the spatial index of the counters lines and the control zones lines
+    index = build_index(counters, czones, HEIGHT, WIDTH)
 
     # Build the speed tracker
-    trackerspeed = TrackerSpeedEstimator(video_capture=video_capture, czones=czones)
+    trackerspeed = TrackerSpeedEstimator(video_capture=video_capture, czones=czones, index=index,
+                                         max_disappeared=max_disappeared, max_distance=max_distance)
+
+    # Build the motion gate, frames without motion around the counters and control zones skip the detector
+    gate = None
+    if motion_gate:
+        gate = MotionGate(roi=geometry_roi(counters, czones, HEIGHT, WIDTH))
+
+    # The audit runs the detector on every frame through a shadow tracker and shadow counters
+    # to measure the counts missed by the motion gate
+    audit_counters, audit_trackerspeed = None, None
+    if gate_audit:
+        audit_counters = [copy.deepcopy(counter) for counter in counters]
+        audit_trackerspeed = TrackerSpeedEstimator(video_capture=video_capture, czones=czones,
+                                                   max_disappeared=max_disappeared, max_distance=max_distance)
+
+    # Restore the last snapshot, then save the pipeline state periodically
+    nframe = 0
+    resume_frame, resume_rows = None, None
+    snapshotter = None
+    if snapshot_path is not None:
+        if resume:
+            state = load_snapshot(snapshot_path)
+            if state is not None:
+                nframe = restore_snapshot(state, video_capture, trackerspeed, counters)
+                resume_frame, resume_rows = state['frame_pos'], state['track_log_rows']
+                print("Resumed from snapshot at frame {}".format(resume_frame))
+        snapshotter = Snapshotter(snapshot_path, every=snapshot_every)
+
+    # Build the track log, the tracked objects of every frame are saved for offline re-analysis
+    # (a resumed run continues the existing log from the snapshot frame)
+    track_log = None
+    if track_log_path is not None:
+        # the centroids of a frame cache are in cropped and scaled pixels, the mapping is saved with the log
+        track_log = TrackLogWriter(track_log_path, fps=FPS, classes=classes,
+                                   scale=getattr(video_capture, 'scale', 1.),
+                                   offset=getattr(video_capture, 'offset', (0, 0)), resume_frame=resume_frame,
+                                   resume_rows=resume_rows)
+
+    # Reusable frame buffers
+    pool = FramePool() if frame_pool else None
 
     while video_capture.isOpened():
         # Capture frame-by-frame
-        ret, frame = video_capture.read()
+        if pool is not None:
+            ret, img = pool.read(video_capture)
+        else:
+            ret, img = video_capture.read()
 
         if not ret:
             break
 
-        img = frame.copy()
-
-        result, detections = detector.detect(img)
-        if len(detections) == 0:
-            continue
+        detected = nframe % detect_every == 0 and (gate is None or gate.has_motion(img))
+        if detected:
+            result, detections = detector.detect(img, pool=pool)
+        else:
+            # no detection : the tracker still ages its objects on this frame
+            result, detections = img, empty_detections()
+        nframe += 1
+
+        if gate_audit:
+            # the full detection only runs again on the frames skipped by the gate
+            full_detections = detections if detected else detector.detect(img)[1]
+            audit_trackerspeed.track(full_detections)
+            audit_trackerspeed.map_centroid_class()
+            for counter in audit_counters:
+                counter.count_class(audit_trackerspeed.objects, audit_trackerspeed.mapped_centroid_classes)
 
         trackerspeed.track(detections)
 
         # counting objects
         trackerspeed.map_centroid_class()
 
-        # Couting Display
-        for counter in counters:
-            _ = counter.count_class(trackerspeed.objects, trackerspeed.mapped_centroid_classes)
-            counter.count_display(img=result, icons=icons)
-
-        cv2.namedWindow("video", cv2.WINDOW_AUTOSIZE)
-        for czone in czones:
-            result = czone.display_zone(img=result)
+        if track_log is not None:
+            track_log.append(int(video_capture.get(cv2.CAP_PROP_POS_FRAMES)) - 1,
+                             trackerspeed.objects, trackerspeed.mapped_centroid_classes)
 
+        count_classes_indexed(counters, index, trackerspeed.objects, trackerspeed.mapped_centroid_classes)
         trackerspeed.compute_speed()
-        trackerspeed.display_speed(img=result)
 
-        trackerspeed.display_tracking(img=result)
+        # the overlays are only drawn when the frame is written, shown or sent to a preview client
+        preview = server is not None and server.wants_frame()
+        if out is not None or show or preview:
+            # Couting Display
+            for counter in counters:
+                counter.count_display(img=result, icons=icons)
 
-        out.write(result)
-        cv2.imshow("video", result)
+            for czone in czones:
+                result = czone.display_zone(img=result, pool=pool)
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+            trackerspeed.display_speed(img=result)
 
-    detector.close()
-    video_capture.release()
-    cv2.destroyAllWindows()
-    out.release()
+            trackerspeed.display_tracking(img=result)
+        else:
+            trackerspeed.display_speed(img=None)
+
+        if snapshotter is not None:
+            snapshotter.maybe_save(nframe, int(video_capture.get(cv2.CAP_PROP_POS_FRAMES)), trackerspeed, counters,
+                                   track_log=track_log)
+
+        if server is not None:
+            server.publish_stats(nframe, counters, trackerspeed)
+            if preview:
+                server.publish_frame(result)
+
+        if out is not None:
+            out.write(result)
+
+        if show:
+            cv2.namedWindow("video", cv2.WINDOW_AUTOSIZE)
+            cv2.imshow("video", result)
+
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+
+    if gate is not None:
+        print("Motion gate : {} / {} frames skipped ({:.1%})".format(gate.n_skipped, gate.n_frames, gate.skip_ratio))
+        if gate_audit:
+            for i, (counter, audit_counter) in enumerate(zip(counters, audit_counters)):
+                missed = dict(zip(classes, (audit_counter.counts - counter.counts).tolist()))
+                print("Counter {} : missed counts against full detection {}".format(i, missed))
+
+    if track_log is not None:
+        track_log.close()
+
+    if snapshotter is not None:
+        snapshotter.close()
+
+    return trackerspeed
 
 
 def get_args():
     parser = argparse.ArgumentParser(description='Run the traffic counting demo script')
     parser.add_argument('--in', dest='input_path', default="videos/Road_traffic_cut.mp4",
                         help='Path the input video')
-    parser.add_argument('--out', dest='output_path', default="output.avi",
-                        help='Path the output video (MUST BE .avi)')
+    parser.add_argument('--out', dest='output_path', default=None,
+                        help='Path the output video (MUST BE .avi, not written if not set)')
     parser.add_argument('-w', dest='weights', default="yolov3_weights/pretrained-yolov3.h5",
                         help='Path the yolov3 weights')
+    parser.add_argument('--motion-gate', dest='motion_gate', action='store_true',
+                        help='Skip the detection on frames without motion around the counters and control zones')
+    parser.add_argument('--gate-audit', dest='gate_audit', action='store_true',
+                        help='Also run the full detection to report the counts missed by the motion gate (slow)')
+    parser.add_argument('--track-log', dest='track_log', default=None,
+                        help='Directory of the columnar track log of the tracked objects (not saved if not set)')
+    parser.add_argument('--snapshot', dest='snapshot', default=None,
+                        help='Path the snapshot file of the tracker, counters and speeds states (not saved if not set)')
+    parser.add_argument('--snapshot-every', dest='snapshot_every', type=int, default=60,
+                        help='Number of seconds of video between two snapshots')
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help='Restore the snapshot and resume the video from the snapshot frame')
+    parser.add_argument('--frame-cache', dest='frame_cache', default=None,
+                        help='Path the decoded frames cache, built from the input video if it does not exist')
+    parser.add_argument('--cache-scale', dest='cache_scale', type=float, default=1.,
+                        help='Resize factor of the frames saved in the cache')
+    parser.add_argument('--cache-crop', dest='cache_crop', type=int, nargs=4, default=None,
+                        metavar=('X1', 'Y1', 'X2', 'Y2'),
+                        help='Region of interest of the frames saved in the cache, in pixels of the input video')
+    parser.add_argument('--max-distance', dest='max_distance', type=float, default=None,
+                        help='Maximum displacement in pixels of a tracked object between two frames '
+                             '(not gated if not set)')
+    parser.add_argument('--serve', dest='serve_port', type=int, default=None,
+                        help='Port of the local HTTP server of the statistics and of the MJPEG preview '
+                             '(not served if not set)')
+    parser.add_argument('--preview-fps', dest='preview_fps', type=float, default=5,
+                        help='Maximum frame rate of the MJPEG preview')
+    parser.add_argument('--no-window', dest='no_window', action='store_true',
+                        help='Do not display the output video in a window')
     args = parser.parse_args()
-    return args.input_path, args.output_path, args.weights
+    if args.gate_audit and not args.motion_gate:
+        parser.error('--gate-audit needs --motion-gate')
+    if args.frame_cache is None and (args.cache_scale != 1. or args.cache_crop is not None):
+        parser.error('--cache-scale and --cache-crop need --frame-cache')
+    return args
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """MotionGate class decides whether a frame is worth running the detector on.
+
+    Note : a MOG2 background subtractor is run on a downscaled crop of the region of interest
+           (the area around the counters and control zones). When the fraction of moving pixels
+           is under min_motion the frame can skip the detection step.
+
+    Args:
+        roi (tuple of int): (x1, y1, x2, y2) region of interest in pixels
+        scale (float): downscale factor applied to the region of interest
+        min_motion (float): minimal fraction of foreground pixels to consider the frame as moving
+        history (int): MOG2 history length in frames
+        var_threshold (float): MOG2 variance threshold
+
+    Attributes:
+        roi (tuple of int): (x1, y1, x2, y2) region of interest in pixels
+        scale (float): downscale factor applied to the region of interest
+        min_motion (float): minimal fraction of foreground pixels to consider the frame as moving
+        subtractor (object): opencv MOG2 background subtractor
+        n_frames (int): number of frames seen by the gate
+        n_skipped (int): number of frames without motion
+    """
+
+    def __init__(self, roi, scale=0.25, min_motion=0.002, history=500, var_threshold=16):
+        self.roi = roi
+        self.scale = scale
+        self.min_motion = min_motion
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(history=history, varThreshold=var_threshold,
+                                                             detectShadows=False)
+        self.kernel = np.ones((3, 3), np.uint8)
+        self.n_frames = 0
+        self.n_skipped = 0
+
+    def has_motion(self, img):
+        """Checks if there is motion in the region of interest of the input image
+
+        Args:
+            img (numpy 2D array): input image
+        Returns:
+            bool : True if the frame must go through the detector, False otherwise
+        """
+        x1, y1, x2, y2 = self.roi
+        crop = img[y1:y2, x1:x2]
+        small = cv2.resize(crop, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        mask = self.subtractor.apply(small)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+
+        self.n_frames += 1
+        moving = cv2.countNonZero(mask) >= self.min_motion * mask.size
+        if not moving:
+            self.n_skipped += 1
+        return moving
+
+    @property
+    def skip_ratio(self):
+        """Fraction of frames for which the detection was skipped"""
+        if self.n_frames == 0:
+            return 0.
+        return self.n_skipped / self.n_frames
+
+
+def geometry_roi(counters, czones, height, width, margin=40):
+    """Computes the bounding box of the counters lines and the control zones
+
+    Args:
+        counters (list of Counter object): counters
+        czones (list of Control_zone object): control zones
+        height (int): image height in pixels
+        width (int): image width in pixels
+        margin (int): margin in pixels added around the geometry
+    Returns:
+        roi (tuple of int): (x1, y1, x2, y2) region of interest clipped to the image
+    """
+    pts = []
+    for counter in counters:
+        x1, y1, x2, y2 = counter.border
+        pts += [(x1, y1), (x2, y2)]
+    for czone in czones:
+        pts += list(czone.border1) + list(czone.border2)
+    pts = np.array(pts)
+
+    x1, y1 = pts.min(axis=0) - margin
+    x2, y2 = pts.max(axis=0) + margin
+    return max(0, int(x1)), max(0, int(y1)), min(width, int(x2)), min(height, int(y2))
@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import json
+import math
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import cv2
+import numpy as np
+
+INDEX_PAGE = b"""<!DOCTYPE html>
+<html><head><title>Traffic counting</title></head>
+<body>
+<img src="/preview.mjpg">
+<pre id="stats"></pre>
+<script>
+setInterval(function () {
+    fetch("/stats").then(r => r.json()).then(s => {
+        document.getElementById("stats").textContent = JSON.stringify(s, null, 2);
+    });
+}, 1000);
+</script>
+</body></html>
+"""
+
+BOUNDARY = 'frame'
+
+
+def to_json(obj):
+    """Converts numpy values and nan of the statistics to JSON values (nan is null)
+    """
+    if isinstance(obj, dict):
+        return {str(k): to_json(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_json(v) for v in obj]
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, (float, np.floating)):
+        return None if math.isnan(obj) else float(obj)
+    return obj
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in a daemon thread (http.server.ThreadingHTTPServer needs python 3.7)
+    """
+    daemon_threads = True
+
+
+class PreviewServer:
+    """PreviewServer class serves the counts, the control zones speed statistics and an MJPEG preview of the
+    annotated video over HTTP, from a background thread
+
+    Note : the frame loop asks wants_frame() before drawing, so the overlays are only drawn and JPEG-encoded
+           while a preview client is connected, at most max_fps times per second. The JPEG bytes and the
+           statistics are copies, the served data never points to the pooled frame buffers.
+
+    Endpoints :
+        /               page with the preview and the statistics
+        /stats          JSON counts of each counter and speed statistics of each control zone
+        /preview.mjpg   MJPEG stream of the annotated video
+
+    Args:
+        host (str): address the server listens to
+        port (int): port the server listens to
+        max_fps (float): maximum frame rate of the preview
+        jpeg_quality (int): JPEG quality of the preview frames (0 - 100)
+        stats_period (float): minimum time between two statistics updates in seconds
+
+    Attributes:
+        n_clients (int): number of connected preview clients
+        n_frames (int): number of encoded preview frames
+    """
+
+    def __init__(self, host='127.0.0.1', port=8080, max_fps=5., jpeg_quality=80, stats_period=0.5):
+        self.max_fps = max_fps
+        self.jpeg_quality = jpeg_quality
+        self.stats_period = stats_period
+        self.n_clients = 0
+        self.n_frames = 0
+        self._jpeg = None
+        self._stats = b'{}'
+        self._last_frame_t = -math.inf
+        self._last_stats_t = -math.inf
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.httpd = ThreadingHTTPServer((host, port), PreviewHandler)
+        self.httpd.preview = self
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}/".format(host, port)
+
+    def wants_frame(self):
+        """Returns True if a preview client is connected and the previous frame is older than 1 / max_fps
+        """
+        return self.n_clients > 0 and time.monotonic() - self._last_frame_t >= 1. / self.max_fps
+
+    def publish_frame(self, img):
+        """Encodes the annotated frame and sends it to the preview clients
+        """
+        ret, jpeg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+        if not ret:
+            return
+        with self._cond:
+            self._jpeg = jpeg.tobytes()
+            self.n_frames += 1
+            self._cond.notify_all()
+        self._last_frame_t = time.monotonic()
+
+    def publish_stats(self, nframe, counters, trackerspeed):
+        """Updates the served statistics, at most once every stats_period seconds
+
+        Args:
+            nframe (int): number of processed frames
+            counters (list of Counter object): counters
+            trackerspeed (TrackerSpeedEstimator object): tracker and speed estimator
+        """
+        if time.monotonic() - self._last_stats_t < self.stats_period:
+            return
+        stats = dict(frame=nframe, counters=[counter.counts_classes for counter in counters],
+                     zones=trackerspeed.zone_stats())
+        stats = json.dumps(to_json(stats)).encode()
+        with self._cond:
+            self._stats = stats
+        self._last_stats_t = time.monotonic()
+
+    def stats(self):
+        with self._cond:
+            return self._stats
+
+    def next_frame(self, n_seen, timeout=1.):
+        """Waits for a frame more recent than the frame n_seen
+
+        Returns:
+            n_frames (int): number of the returned frame
+            jpeg (bytes): JPEG frame, None if the server is closed or no new frame came before the timeout
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.n_frames > n_seen or self._closed, timeout=timeout)
+            if self._closed or self.n_frames <= n_seen:
+                return n_seen, None
+            return self.n_frames, self._jpeg
+
+    def _client(self, n):
+        with self._cond:
+            self.n_clients += n
+
+    def close(self):
+        """Stops the server and disconnects the preview clients
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    """Request handler of the PreviewServer endpoints
+    """
+
+    def do_GET(self):
+        preview = self.server.preview
+        if self.path == '/':
+            self._send(200, 'text/html', INDEX_PAGE)
+        elif self.path == '/stats':
+            self._send(200, 'application/json', preview.stats())
+        elif self.path == '/preview.mjpg':
+            self._stream(preview)
+        else:
+            self._send(404, 'text/plain', b'Not found')
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, preview):
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary={}'.format(BOUNDARY))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        preview._client(1)
+        try:
+            n_seen = 0
+            while not preview.closed:
+                n_seen, jpeg = preview.next_frame(n_seen)
+                if jpeg is None:
+                    continue
+                self.wfile.write("--{}\r\nContent-Type: image/jpeg\r\nContent-Length: {}\r\n\r\n".format(
+                    BOUNDARY, len(jpeg)).encode())
+                self.wfile.write(jpeg)
+                self.wfile.write(b'\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            preview._client(-1)
+
+    def log_message(self, format, *args):
+        # no log line for each request
+        pass
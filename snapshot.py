@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import os
+import pickle
+import threading
+
+import cv2
+
+SNAPSHOT_VERSION = 3
+
+
+class Snapshotter:
+    """Snapshotter class periodically saves the pipeline state (tracker, counters, speeds and frame position)
+
+    Note : the state is copied on the frame loop (get_state methods), the pickling and the disk write are done by
+           a background thread. If the thread is still writing when the next snapshot is taken, only the most
+           recent pending snapshot is kept. Files are written to a temporary file then renamed, so a crash never
+           leaves a partial snapshot. The track log rows are written before the state is copied, and their number
+           is saved in the snapshot.
+
+    Args:
+        path (str): path of the snapshot file
+        every (int): number of frames between two snapshots
+
+    Attributes:
+        path (str): path of the snapshot file
+        every (int): number of frames between two snapshots
+        n_written (int): number of snapshots written
+    """
+
+    def __init__(self, path, every):
+        self.path = path
+        self.every = every
+        self.n_written = 0
+        self._pending = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._write_snapshots, daemon=True)
+        self._thread.start()
+
+    def maybe_save(self, nframe, frame_pos, trackerspeed, counters, track_log=None):
+        """Takes a snapshot every self.every frames
+
+        Args:
+            nframe (int): number of processed frames
+            frame_pos (int): position of the next frame to read in the video (CAP_PROP_POS_FRAMES)
+            trackerspeed (TrackerSpeedEstimator object): tracker and speed estimator
+            counters (list of Counter object): counters
+            track_log (TrackLogWriter object): optional track log, synced before the snapshot
+        """
+        if nframe % self.every == 0:
+            self.save(nframe, frame_pos, trackerspeed, counters, track_log)
+
+    def save(self, nframe, frame_pos, trackerspeed, counters, track_log=None):
+        """Takes a snapshot, the file is written by the background thread
+        """
+        track_log_rows = track_log.sync() if track_log is not None else None
+        state = dict(version=SNAPSHOT_VERSION, nframe=nframe, frame_pos=frame_pos, track_log_rows=track_log_rows,
+                     trackerspeed=trackerspeed.get_state(), counters=[counter.get_state() for counter in counters])
+        with self._cond:
+            self._pending = state
+            self._cond.notify()
+
+    def close(self):
+        """Writes the pending snapshot and stops the background thread
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _write_snapshots(self):
+        """Background thread : writes the most recent pending snapshot
+        """
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                state, self._pending = self._pending, None
+                if state is None:
+                    return
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self.n_written += 1
+
+
+def load_snapshot(path):
+    """Loads a snapshot written by Snapshotter
+
+    Args:
+        path (str): path of the snapshot file
+    Returns:
+        state (dict): snapshot, None if the file does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if state.get('version') != SNAPSHOT_VERSION:
+        raise ValueError("Snapshot {} version {} is not supported".format(path, state.get('version')))
+    return state
+
+
+def restore_snapshot(state, video_capture, trackerspeed, counters):
+    """Restores the pipeline state and seeks the video to the snapshot frame
+
+    Note : live streams cannot seek, only the tracker, counters and speeds states are restored.
+
+    Args:
+        state (dict): snapshot loaded by load_snapshot
+        video_capture (opencv object): opencv video iterator
+        trackerspeed (TrackerSpeedEstimator object): tracker and speed estimator
+        counters (list of Counter object): counters
+    Returns:
+        nframe (int): number of processed frames at the snapshot time
+    """
+    assert len(counters) == len(state['counters']), 'Snapshot has {} counters, {} are set'.format(
+        len(state['counters']), len(counters))
+    trackerspeed.set_state(state['trackerspeed'])
+    for counter, counter_state in zip(counters, state['counters']):
+        counter.set_state(counter_state)
+    video_capture.set(cv2.CAP_PROP_POS_FRAMES, state['frame_pos'])
+    return state['nframe']
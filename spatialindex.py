@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+from utils import *
+
+
+class SpatialIndex:
+    """SpatialIndex class is a uniform grid over the counters line bands and the control zones entry/exit bands
+
+    Note : every band is registered in all the cells overlapped by its bounding box, so a centroid is only
+           tested against the few bands of its own cell instead of every counter and every control zone.
+
+    Args:
+        height (int): image height in pixels
+        width (int): image width in pixels
+        cell_size (int): size in pixels of the grid cells
+
+    Attributes:
+        height (int): image height in pixels
+        width (int): image width in pixels
+        cell_size (int): size in pixels of the grid cells
+        entries (list of tuple): registered (owner, tag, polygone) bands
+        cells (dict): dictionnary of grid cells and the indexes of the bands overlapping them
+                      (ie {(10, 12): [0, 3], (11, 12): [0]})
+    """
+
+    def __init__(self, height, width, cell_size=32):
+        self.height = height
+        self.width = width
+        self.cell_size = cell_size
+        self.entries = []
+        self.cells = {}
+
+    def add(self, owner, tag, poly):
+        """Registers a band polygone
+
+        Args:
+            owner (object): object owning the band (Counter or Control_zone)
+            tag (str): kind of band ('border', 'start' or 'exit')
+            poly (list of tuple float): polygone list of (x,y) coordinates
+        """
+        ientry = len(self.entries)
+        self.entries.append((owner, tag, poly))
+
+        xs = [p[0] for p in poly]
+        ys = [p[1] for p in poly]
+        c1, r1 = self._cell(min(xs), min(ys))
+        c2, r2 = self._cell(max(xs), max(ys))
+        for r in range(r1, r2 + 1):
+            for c in range(c1, c2 + 1):
+                self.cells.setdefault((c, r), []).append(ientry)
+
+    def add_counter(self, counter):
+        """Registers the counting line band of a counter
+
+        Args:
+            counter (Counter object): counter
+        """
+        self.add(counter, 'border', counter.band())
+
+    def add_czone(self, czone):
+        """Registers the entry and exit bands of a control zone
+
+        Args:
+            czone (Control_zone object): control zone
+        """
+        self.add(czone, 'start', czone.start_band())
+        self.add(czone, 'exit', czone.exit_band())
+
+    def query(self, xy):
+        """Finds the bands containing the point (x,y)
+
+        Args:
+            xy (list of int): [x,y] coordinates of the point
+        Returns:
+            hits (list of tuple): (owner, tag) of the bands containing the point, in registration order
+        """
+        x, y = xy[0], xy[1]
+        hits = []
+        for ientry in self.cells.get(self._cell(x, y), ()):
+            owner, tag, poly = self.entries[ientry]
+            if point_inside_polygon(x, y, poly):
+                hits.append((owner, tag))
+        return hits
+
+    def _cell(self, x, y):
+        """Grid cell of the point (x,y), points outside of the image are clipped to the border cells
+        """
+        c = int(min(max(x, 0), self.width - 1)) // self.cell_size
+        r = int(min(max(y, 0), self.height - 1)) // self.cell_size
+        return c, r
+
+
+def build_index(counters, czones, height, width, cell_size=32):
+    """Builds the spatial index of the counters and the control zones
+
+    Args:
+        counters (list of Counter object): counters
+        czones (list of Control_zone object): control zones
+        height (int): image height in pixels
+        width (int): image width in pixels
+        cell_size (int): size in pixels of the grid cells
+    Returns:
+        index (SpatialIndex object): spatial index
+    """
+    index = SpatialIndex(height=height, width=width, cell_size=cell_size)
+    for counter in counters:
+        index.add_counter(counter)
+    for czone in czones:
+        index.add_czone(czone)
+    return index
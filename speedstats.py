@@ -0,0 +1,169 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+from collections import deque
+
+import numpy as np
+
+
+class SpeedSketch:
+    """SpeedSketch class is a mergeable fixed-bins histogram of speeds giving approximate percentiles
+
+    Note : percentiles are accurate to bin_width / 2, speeds over max_speed fall in the last bin.
+
+    Args:
+        bin_width (float): width of the bins in km/h
+        max_speed (float): upper bound of the histogram in km/h
+
+    Attributes:
+        bin_width (float): width of the bins in km/h
+        counts (numpy array): number of speeds in each bin
+    """
+
+    def __init__(self, bin_width=0.5, max_speed=300.):
+        self.bin_width = bin_width
+        self.counts = np.zeros(int(np.ceil(max_speed / bin_width)) + 1, dtype=np.int64)
+
+    def add(self, speed, n=1):
+        """Adds (or removes with n=-1) a speed
+        """
+        ibin = min(max(int(speed / self.bin_width), 0), len(self.counts) - 1)
+        self.counts[ibin] += n
+
+    def merge(self, other):
+        """Adds the speeds of another sketch with the same bins
+        """
+        assert self.counts.shape == other.counts.shape and self.bin_width == other.bin_width, 'Sketches bins differ'
+        self.counts += other.counts
+
+    def quantile(self, q):
+        """Returns the approximate q quantile (0 <= q <= 1), nan if the sketch is empty
+        """
+        n = self.counts.sum()
+        if n == 0:
+            return np.nan
+        ibin = np.searchsorted(np.cumsum(self.counts), q * n, side='left')
+        return (ibin + 0.5) * self.bin_width
+
+
+class ZoneSpeedStats:
+    """ZoneSpeedStats class keeps streaming statistics of the speeds measured in a control zone
+
+    Note : each update is O(1) (amortized for the rolling windows), so the statistics can be queried on every frame.
+           A measure can be revised (the live estimator updates a speed while the element is in the end line band),
+           the previous value of the same key is then replaced.
+
+    Args:
+        speedlimit (float): speed limit in km/h
+        windows (tuple of float): rolling windows durations in seconds
+        bin_width (float): width of the percentiles sketch bins in km/h
+
+    Attributes:
+        speedlimit (float): speed limit in km/h
+        n (int): number of measures
+        mean (float): running mean speed
+        sketch (SpeedSketch object): percentiles sketch
+        n_over (int): number of measures over the speed limit
+        windows (dict): rolling windows sums and measures keys (ie {300: {'n': 4, 'sum': 420.5, 'n_over': 1, ...}})
+        measures (dict): time and speed of the measures still in the largest window
+    """
+
+    def __init__(self, speedlimit, windows=(300, 3600), bin_width=0.5):
+        self.speedlimit = speedlimit
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.n_over = 0
+        self.sketch = SpeedSketch(bin_width=bin_width)
+        self.windows = {w: dict(n=0, sum=0., n_over=0, keys=deque(), cutoff=-np.inf) for w in windows}
+        self.measures = {}
+
+    def add(self, key, speed, t):
+        """Adds a measure, or revises the measure of the same key
+
+        Args:
+            key (int): id of the measured element
+            speed (float): speed in km/h
+            t (float): time of the measure in seconds
+        """
+        if key in self.measures:
+            # revision : the measure keeps its first time, it is only replaced in the windows it is still in
+            t_key, speed_prev = self.measures[key]
+            self._update(speed_prev, -1)
+            windows = [window for window in self.windows.values() if t_key > window['cutoff']]
+            for window in windows:
+                self._window_add(window, speed_prev, -1)
+        else:
+            t_key = t
+            windows = list(self.windows.values())
+            for window in windows:
+                window['keys'].append(key)
+
+        self.measures[key] = (t_key, speed)
+        self._update(speed, 1)
+        for window in windows:
+            self._window_add(window, speed, 1)
+        self._evict(t)
+
+    def _window_add(self, window, speed, n):
+        """Adds (n=1) or removes (n=-1) a speed from the sums of a rolling window
+        """
+        window['n'] += n
+        window['sum'] += n * speed
+        window['n_over'] += n * (speed > self.speedlimit)
+
+    def _update(self, speed, n):
+        """Adds (n=1) or removes (n=-1) a speed from the running mean, variance, sketch and over limit count
+        """
+        if n == 1:
+            self.n += 1
+            delta = speed - self.mean
+            self.mean += delta / self.n
+            self.m2 += delta * (speed - self.mean)
+        elif self.n == 1:
+            self.n, self.mean, self.m2 = 0, 0., 0.
+        else:
+            mean_prev = (self.n * self.mean - speed) / (self.n - 1)
+            self.m2 -= (speed - mean_prev) * (speed - self.mean)
+            self.n -= 1
+            self.mean = mean_prev
+        self.sketch.add(speed, n)
+        self.n_over += n * (speed > self.speedlimit)
+
+    def _evict(self, t):
+        """Removes the measures older than each window duration
+        """
+        for w, window in self.windows.items():
+            keys = window['keys']
+            while len(keys) > 0 and self.measures[keys[0]][0] <= t - w:
+                t_key, speed = self.measures[keys.popleft()]
+                window['cutoff'] = t_key
+                self._window_add(window, speed, -1)
+        # the measures are only needed as long as they are in the largest window
+        if len(self.windows) > 0:
+            largest = self.windows[max(self.windows)]['keys']
+            while len(self.measures) > len(largest):
+                del self.measures[next(iter(self.measures))]
+
+    def query(self, t=None, quantiles=(0.5, 0.85)):
+        """Returns the statistics of the zone
+
+        Args:
+            t (float): current time in seconds, the rolling windows are updated to this time if set
+            quantiles (tuple of float): quantiles of the sketch
+        Returns:
+            stats (dict): n, mean, std, over_limit rate, quantiles (ie 'p85') and rolling windows statistics
+                          (ie {'n': 42, 'mean': 104.2, 'std': 12.1, 'over_limit': 0.05, 'p50': 103.8, 'p85': 116.2,
+                               'windows': {300: {'n': 4, 'mean': 98.5, 'over_limit': 0.}}})
+        """
+        if t is not None:
+            self._evict(t)
+        stats = dict(n=self.n, mean=self.mean if self.n > 0 else np.nan,
+                     std=np.sqrt(self.m2 / self.n) if self.n > 0 else np.nan,
+                     over_limit=self.n_over / self.n if self.n > 0 else np.nan)
+        for q in quantiles:
+            stats['p{}'.format(int(round(q * 100)))] = self.sketch.quantile(q)
+        stats['windows'] = {w: dict(n=window['n'], mean=window['sum'] / window['n'] if window['n'] > 0 else np.nan,
+                                    over_limit=window['n_over'] / window['n'] if window['n'] > 0 else np.nan)
+                            for w, window in self.windows.items()}
+        return stats
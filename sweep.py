@@ -0,0 +1,320 @@
+#! /usr/bin/env python3
+# coding: utf-8
+"""Offline evaluation of many counters and control zones geometries over a recorded track log
+
+usage : python sweep.py --tracks tracks/ --out sweep
+"""
+
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from config import Config
+from tracklog import TrackLog
+
+
+def line_bands(lines, tresh=0.01, y_shift=0):
+    """Vectorized version of utils.line_band
+
+    Args:
+        lines (numpy array): (L, 4) array of x1, y1, x2, y2 lines
+        tresh (float): treshold of the extented polygone
+        y_shift (float): y offset of the image in the input video, in pixels of the image
+    Returns:
+        polys (numpy array): (L, 4, 2) array of the polygones around the lines
+    """
+    lines = np.asarray(lines, dtype=np.float64)
+    x1, y1, x2, y2 = lines.T
+    return np.stack([np.stack([x1, y1 * (1 - tresh) - y_shift * tresh], axis=1),
+                     np.stack([x2, y2 * (1 - tresh) - y_shift * tresh], axis=1),
+                     np.stack([x2, y2 * (1 + tresh) + y_shift * tresh], axis=1),
+                     np.stack([x1, y1 * (1 + tresh) + y_shift * tresh], axis=1)], axis=1)
+
+
+def log_bands(log, lines, tresh=0.01):
+    """Bands of lines given in pixels of the input video, in the coordinates of the track log
+
+    Note : a log recorded on a cropped or resized frame cache stores the centroids in the cached frames
+           coordinates, the lines are mapped like framecache.map_geometry and the bands keep the thickness they
+           have on the input video, like the live pipeline.
+
+    Args:
+        log (TrackLog object): recorded tracks
+        lines (numpy array): (L, 4) array of x1, y1, x2, y2 lines in pixels of the input video
+        tresh (float): treshold of the extented polygone
+    Returns:
+        polys (numpy array): (L, 4, 2) array of the polygones around the lines
+    """
+    (x, y), scale = log.offset, log.scale
+    lines = np.round((np.asarray(lines, dtype=np.float64) - (x, y, x, y)) * scale)
+    return line_bands(lines, tresh=tresh, y_shift=y * scale)
+
+
+def points_in_polygons(x, y, polys):
+    """Vectorized version of utils.point_inside_polygon for pairs of points and polygones
+
+    Args:
+        x (numpy array): (K,) x coordinates of the points
+        y (numpy array): (K,) y coordinates of the points
+        polys (numpy array): (K, N, 2) array of polygones
+    Returns:
+        inside (numpy array): (K,) boolean array, True when the point is in its polygone
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    inside = np.zeros(x.shape[0], dtype=bool)
+    for i in range(polys.shape[1]):
+        p1x, p1y = polys[:, i - 1, 0], polys[:, i - 1, 1]
+        p2x, p2y = polys[:, i, 0], polys[:, i, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+        crossing = ((y > np.minimum(p1y, p2y)) & (y <= np.maximum(p1y, p2y)) & (x <= np.maximum(p1x, p2x))
+                    & ((p1x == p2x) | (x <= xinters)))
+        inside ^= crossing
+    return inside
+
+
+def _band_hits(x, y, polys, chunk_size):
+    """Returns the (row, polygone) pairs of the points inside the polygones
+
+    Note : a point can only be inside a polygone if min(poly y) < y <= max(poly y), the points are sorted by y
+           so that only the points of this range are tested against each polygone, by chunks of pairs.
+    """
+    x = np.asarray(x)
+    y_order = np.argsort(y, kind='stable')
+    y_sorted = np.asarray(y)[y_order]
+    lo = np.searchsorted(y_sorted, polys[:, :, 1].min(axis=1), side='right')
+    hi = np.searchsorted(y_sorted, polys[:, :, 1].max(axis=1), side='right')
+    n_pairs = np.maximum(hi - lo, 0)
+
+    rows, ipolys = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    ends = np.cumsum(n_pairs)
+    start = 0
+    while start < len(polys):
+        # chunk of polygones with at most chunk_size candidate pairs (at least one polygone)
+        stop = max(start + 1, np.searchsorted(ends, ends[start] - n_pairs[start] + chunk_size, side='right'))
+        counts = n_pairs[start:stop]
+        ipoly = np.repeat(np.arange(start, stop), counts)
+        pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo[start:stop],
+                                                                                                  counts)
+        row = y_order[pos]
+        inside = points_in_polygons(x[row], y_sorted[pos], polys[ipoly])
+        rows.append(row[inside])
+        ipolys.append(ipoly[inside])
+        start = stop
+    return np.concatenate(rows), np.concatenate(ipolys)
+
+
+def evaluate_counters(log, lines, chunk_size=2 ** 20):
+    """Counts per class for every candidate counting line, like Counter.count_class over the whole video
+
+    Note : each tracked object is counted once per line, with the class mapped at the first frame
+           its centroid is in the line band.
+
+    Args:
+        log (TrackLog object): recorded tracks
+        lines (numpy array): (L, 4) array of x1, y1, x2, y2 candidate lines in pixels of the input video
+        chunk_size (int): maximum number of (point, line) candidate pairs tested at once
+    Returns:
+        counts (numpy 2D array): (L, number of classes) counts, columns follow log.classes
+    """
+    lines = np.asarray(lines)
+    n_classes = len(log.classes)
+    track_id = np.asarray(log.columns['track_id'], dtype=np.int64)
+    cls = np.asarray(log.columns['cls'], dtype=np.int64)
+    rows, ilines = _band_hits(log.columns['x'], log.columns['y'], log_bands(log, lines), chunk_size)
+
+    # rows are in frame order : the first occurrence of each (line, track) pair is the counting frame
+    order = np.argsort(rows, kind='stable')
+    rows, ilines = rows[order], ilines[order]
+    pairs = ilines * (track_id.max(initial=0) + 1) + track_id[rows]
+    _, first = np.unique(pairs, return_index=True)
+    rows, ilines = rows[first], ilines[first]
+    known = cls[rows] >= 0
+
+    counts = np.bincount(ilines[known] * n_classes + cls[rows][known], minlength=len(lines) * n_classes)
+    return counts.reshape(len(lines), n_classes)
+
+
+def evaluate_czones(log, starts, exits, distances, fps=None, ndisplay_frames=20, chunk_size=2 ** 20):
+    """Speed estimates for every candidate control zone, like TrackerSpeedEstimator.compute_speed
+
+    Note : each candidate zone is evaluated on its own. A tracked object is measured between the last frame
+           in the start band before its first frame in the end band, and its last frame in the end band
+           while the speed is displayed (ndisplay_frames of TrackerSpeedEstimator.display_speed).
+
+    Args:
+        log (TrackLog object): recorded tracks
+        starts (numpy array): (Z, 4) array of x1, y1, x2, y2 start lines in pixels of the input video
+        exits (numpy array): (Z, 4) array of x3, y3, x4, y4 end lines in pixels of the input video
+        distances (numpy array): (Z,) distances in meters between the start and the end lines
+        fps (int): frame rate of the video, log.fps if not set
+        ndisplay_frames (int): number of frames the speed is displayed after the end line
+        chunk_size (int): maximum number of (point, line) candidate pairs tested at once
+    Returns:
+        izones (numpy array): zone index of each measure
+        track_ids (numpy array): tracked object id of each measure
+        speeds (numpy array): speed of each measure in km/h
+    """
+    fps = fps or log.fps
+    n_zones = len(starts)
+    frame = np.asarray(log.columns['frame'], dtype=np.int64)
+    track_id = np.asarray(log.columns['track_id'], dtype=np.int64)
+
+    polys = np.concatenate([log_bands(log, starts, tresh=0.015), log_bands(log, exits, tresh=0.015)])
+    rows, ipolys = _band_hits(log.columns['x'], log.columns['y'], polys, chunk_size)
+    is_exit = ipolys >= n_zones
+    izones = np.where(is_exit, ipolys - n_zones, ipolys)
+
+    # sort the band events by (zone, track, frame), a start event comes before an exit event of the same frame
+    order = np.lexsort((is_exit, frame[rows], track_id[rows], izones))
+    rows, is_exit, izones = rows[order], is_exit[order], izones[order]
+    tracks, frames = track_id[rows], frame[rows]
+    new_group = np.ones(len(rows), dtype=bool)
+    new_group[1:] = (izones[1:] != izones[:-1]) | (tracks[1:] != tracks[:-1])
+    group = np.cumsum(new_group) - 1
+
+    # running last start frame inside each (zone, track) group, -1 when no start event has been seen yet
+    span = frame.max(initial=0) + 2
+    last_start = np.maximum.accumulate(np.where(is_exit, group * span - 1, group * span + frames)) - group * span
+
+    valid = is_exit & (last_start >= 0) & (frames > last_start)
+    _, first = np.unique(group[valid], return_index=True)
+    measured = np.nonzero(valid)[0][first]
+
+    # like the live estimator, the end frame is the last frame in the end band while the speed is displayed
+    exit_frames = np.full(group.max(initial=-1) + 1, -1)
+    exit_frames[group[measured]] = frames[measured]
+    start_frames = np.full(len(exit_frames), -1)
+    start_frames[group[measured]] = last_start[measured]
+    same_crossing = (valid & (last_start == start_frames[group])
+                     & (frames <= exit_frames[group] + ndisplay_frames + 1))
+    np.maximum.at(exit_frames, group[same_crossing], frames[same_crossing])
+
+    n_present_frames = exit_frames[group[measured]] - last_start[measured]
+    izones = izones[measured]
+    speeds = ((np.asarray(distances, dtype=np.float64)[izones] / (n_present_frames / fps)) * 3600) / 1000  # km/h
+    return izones, tracks[measured], speeds
+
+
+def speed_table(izones, speeds, n_zones, speedlimit=None):
+    """Aggregates the speed measures per zone
+
+    Args:
+        izones (numpy array): zone index of each measure
+        speeds (numpy array): speed of each measure in km/h
+        n_zones (int): number of zones
+        speedlimit (float or numpy array): speed limit, or speed limit of each measure
+    Returns:
+        stats (dict): dictionnary of (Z,) arrays : n, mean, std, p50, p85 and over_limit rate
+    """
+    n = np.bincount(izones, minlength=n_zones)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(izones, weights=speeds, minlength=n_zones) / n
+        sq = np.bincount(izones, weights=speeds ** 2, minlength=n_zones) / n
+    stats = dict(n=n, mean=mean, std=np.sqrt(np.maximum(sq - mean ** 2, 0)))
+
+    # percentiles : speeds sorted inside each zone
+    order = np.lexsort((speeds, izones))
+    sorted_speeds = speeds[order]
+    offsets = np.concatenate([[0], np.cumsum(n)])
+    for name, q in [('p50', 0.5), ('p85', 0.85)]:
+        idx = offsets[:-1] + np.floor(q * np.maximum(n - 1, 0)).astype(np.int64)
+        values = sorted_speeds[np.minimum(idx, len(speeds) - 1)] if len(speeds) else np.zeros(n_zones)
+        stats[name] = np.where(n > 0, values, np.nan)
+    if speedlimit is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stats['over_limit'] = np.bincount(izones, weights=speeds > speedlimit, minlength=n_zones) / n
+    return stats
+
+
+def candidate_lines(base_lines, offsets, scales):
+    """Generates candidate lines by shifting vertically and stretching around their middle the base lines
+
+    Args:
+        base_lines (list of tuple int): x1, y1, x2, y2 base lines (ie the config.ini counters)
+        offsets (numpy array): vertical shifts in pixels
+        scales (numpy array): length scale factors
+    Returns:
+        lines (numpy array): (len(base_lines) * len(offsets) * len(scales), 4) candidate lines
+        ibase (numpy array): index of the base line of each candidate
+    """
+    base = np.asarray(base_lines, dtype=np.float64)[:, None, None, :]
+    dy = np.asarray(offsets, dtype=np.float64)[None, :, None]
+    s = np.asarray(scales, dtype=np.float64)[None, None, :]
+    xm, ym = (base[..., 0] + base[..., 2]) / 2, (base[..., 1] + base[..., 3]) / 2
+    hx, hy = (base[..., 2] - base[..., 0]) / 2 * s, (base[..., 3] - base[..., 1]) / 2 * s
+    lines = np.stack(np.broadcast_arrays(xm - hx, ym - hy + dy, xm + hx, ym + hy + dy), axis=-1)
+    ibase = np.broadcast_to(np.arange(len(base_lines))[:, None, None], lines.shape[:3])
+    return lines.reshape(-1, 4), ibase.reshape(-1)
+
+
+def write_table(path, header, columns):
+    """Writes columns of equal length as a csv table
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(zip(*columns))
+
+
+def main():
+    tracks_path, out_prefix, offsets, scales = get_args()
+    log = TrackLog(tracks_path)
+    config = Config()
+    t0 = time.perf_counter()
+
+    # counters : every config.ini counter shifted and stretched
+    lines, ibase = candidate_lines(config.parse_counters(), offsets, scales)
+    counts = evaluate_counters(log, lines)
+    write_table(out_prefix + '_counters.csv', ['base', 'x1', 'y1', 'x2', 'y2'] + log.classes + ['total'],
+                [ibase] + list(np.round(lines).astype(int).T) + list(counts.T) + [counts.sum(axis=1)])
+
+    # control zones : the start and end lines of every config.ini control zone are shifted independently
+    czones = config.parse_czones()
+    starts, exits, distances, limits, ibases = [], [], [], [], []
+    for i, czone in enumerate(czones):
+        start, _ = candidate_lines([sum(czone['start'], ())], offsets, [1.])
+        exit, _ = candidate_lines([sum(czone['exit'], ())], offsets, [1.])
+        istart, iexit = np.meshgrid(np.arange(len(start)), np.arange(len(exit)), indexing='ij')
+        starts.append(start[istart.ravel()])
+        exits.append(exit[iexit.ravel()])
+        distances.append(np.full(istart.size, czone['cz_distance']))
+        limits.append(np.full(istart.size, czone['speed_limit']))
+        ibases.append(np.full(istart.size, czone['id']))
+    starts, exits = np.concatenate(starts), np.concatenate(exits)
+    distances, limits, ibases = np.concatenate(distances), np.concatenate(limits), np.concatenate(ibases)
+
+    izones, _, speeds = evaluate_czones(log, starts, exits, distances)
+    stats = speed_table(izones, speeds, len(starts), speedlimit=limits[izones])
+    write_table(out_prefix + '_czones.csv',
+                ['base', 'x1', 'y1', 'x2', 'y2', 'x3', 'y3', 'x4', 'y4', 'n', 'mean', 'std', 'p50', 'p85',
+                 'over_limit'],
+                [ibases] + list(np.round(starts).astype(int).T) + list(np.round(exits).astype(int).T) +
+                [stats[k] for k in ['n', 'mean', 'std', 'p50', 'p85', 'over_limit']])
+
+    print("{} counters and {} control zones evaluated over {} track rows in {:.2f}s".format(
+        len(lines), len(starts), len(log), time.perf_counter() - t0))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Evaluate many counters and control zones geometries '
+                                                 'over a recorded track log')
+    parser.add_argument('--tracks', dest='tracks_path', default="tracks",
+                        help='Path the track log directory (saved by main.py --track-log)')
+    parser.add_argument('--out', dest='out_prefix', default="sweep",
+                        help='Prefix of the output csv tables')
+    parser.add_argument('--offset', dest='offset', type=int, default=100,
+                        help='Maximum vertical shift in pixels of the candidate lines')
+    parser.add_argument('--step', dest='step', type=int, default=5,
+                        help='Vertical shift step in pixels of the candidate lines')
+    args = parser.parse_args()
+    offsets = np.arange(-args.offset, args.offset + 1, args.step)
+    scales = np.linspace(0.5, 1.5, 11)
+    return args.tracks_path, args.out_prefix, offsets, scales
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import os
+
+import cv2
+import numpy as np
+
+from detections import DETECTION_DTYPE
+
+
+class SyntheticClip:
+    """SyntheticClip class renders a synthetic two-way road clip with ground truth vehicle paths, classes and speeds
+
+    Note : vehicles are the icons/ sprites moving at constant speed along vertical lanes, down on the left half
+           of the road and up on the right half (like the demo video). The clip comes with one counter line and
+           one control zone per direction, so counts and speeds can be compared with the ground truth.
+
+    Args:
+        height (int): image height in pixels
+        width (int): image width in pixels
+        fps (int): frame rate of the clip
+        n_frames (int): number of frames of the clip
+        classes (list of str): vehicle classes (icons/ sprites names)
+        n_lanes (int): number of lanes per direction
+        speed_range (tuple of float): min and max vehicle speeds in km/h
+        seed (int): random seed
+
+    Attributes:
+        height (int): image height in pixels
+        width (int): image width in pixels
+        fps (int): frame rate of the clip
+        n_frames (int): number of frames of the clip
+        classes (list of str): vehicle classes
+        ppm (float): pixels per meter
+        vehicles (list of dict): ground truth vehicles
+                                 (ie [{'id': 0, 'cls': 'car', 'x': 310, 'y0': -40, 'vy': 9.2, 't0': 12,
+                                       'w': 50, 'h': 44, 'speed': 120.0, 'direction': 1}])
+        counters_ini (list of tuple int): x1, y1, x2, y2 counters lines, same format as Config.parse_counters
+        czones_ini (list of dict): control zones, same format as Config.parse_czones
+    """
+
+    def __init__(self, height=720, width=1280, fps=25, n_frames=500, classes=('car', 'truck', 'motorcycle'),
+                 n_lanes=2, speed_range=(70, 140), seed=0):
+        self.height = height
+        self.width = width
+        self.fps = fps
+        self.n_frames = n_frames
+        self.classes = list(classes)
+        self.n_lanes = n_lanes
+        self.speed_range = speed_range
+        self.rng = np.random.RandomState(seed)
+
+        # the frame shows 150 meters of road, as seen from a high-mounted camera
+        self.ppm = height / 150.
+        self.scale = width / 1280.
+        self.sprites = self._load_sprites()
+        self.background = self._render_background()
+        self._build_geometry()
+        self.vehicles = self._spawn_vehicles()
+
+    def _load_sprites(self):
+        """Loads the icons/ sprites of the classes with their alpha mask
+        """
+        sprites = {}
+        dirname = os.path.dirname(os.path.realpath(__file__))
+        for cls in self.classes:
+            icon = cv2.imread(os.path.join(dirname, "icons", cls + '.png'), cv2.IMREAD_UNCHANGED)
+            w = max(8, int(round(icon.shape[1] * self.scale)))
+            h = max(8, int(round(icon.shape[0] * self.scale)))
+            icon = cv2.resize(icon, (w, h), interpolation=cv2.INTER_AREA)
+            sprites[cls] = dict(img=icon[:, :, :3], mask=icon[:, :, 3] > 0, w=w, h=h)
+        return sprites
+
+    def _lanes_x(self, direction):
+        """x coordinates of the lanes centers for a direction (1 down on the left half, -1 up on the right half)
+        """
+        lane_w = self.width / 2. / (self.n_lanes + 1)
+        offset = 0 if direction == 1 else self.width / 2.
+        return [offset + lane_w * (i + 1) for i in range(self.n_lanes)]
+
+    def _render_background(self):
+        """Renders the road background with the lanes markings
+        """
+        bg = np.full((self.height, self.width, 3), 90, np.uint8)
+        noise = self.rng.randint(0, 12, size=(self.height, self.width, 1), dtype=np.uint8)
+        bg = cv2.add(bg, np.repeat(noise, 3, axis=2))
+        lane_w = self.width / 2. / (self.n_lanes + 1)
+        for i in range(2 * (self.n_lanes + 1) + 1):
+            x = int(i * lane_w)
+            for y in range(0, self.height, 40):
+                cv2.line(bg, (x, y), (x, y + 20), (220, 220, 220), max(1, int(2 * self.scale)))
+        return bg
+
+    def _build_geometry(self):
+        """One counter line and one control zone per direction
+        """
+        y_count = int(0.55 * self.height)
+        y_top, y_bottom = int(0.45 * self.height), int(0.65 * self.height)
+        d_zone = (y_bottom - y_top) / self.ppm
+
+        self.counters_ini = []
+        self.czones_ini = []
+        for idczone, direction in enumerate([1, -1]):
+            x_left = int(self.width / 2. * (0 if direction == 1 else 1) + 5)
+            x_right = int(x_left + self.width / 2. - 10)
+            self.counters_ini.append((x_left, y_count, x_right, y_count))
+            # same points order as the config.ini control zones
+            if direction == 1:
+                start = ((x_right, y_top), (x_left, y_top))
+                exit = ((x_left, y_bottom), (x_right, y_bottom))
+            else:
+                start = ((x_left, y_bottom), (x_right, y_bottom))
+                exit = ((x_right, y_top), (x_left, y_top))
+            self.czones_ini.append(dict(id=idczone, speed_limit=130, cz_distance=d_zone, start=start, exit=exit))
+
+    def _spawn_vehicles(self):
+        """Spawns the vehicles of every lane without overtaking
+        """
+        vehicles = []
+        margin = 60 * self.scale
+        for direction in [1, -1]:
+            for x in self._lanes_x(direction):
+                t_prev, v_prev = None, None
+                while True:
+                    cls = self.classes[self.rng.randint(len(self.classes))]
+                    speed = self.rng.uniform(*self.speed_range)
+                    vy = speed / 3.6 * self.ppm / self.fps
+                    h = self.sprites[cls]['h']
+                    length = self.height + 2 * margin
+                    if t_prev is None:
+                        t0 = self.rng.uniform(-length / vy, 30)
+                    else:
+                        # the new vehicle must not catch the previous one before it leaves the frame
+                        t0 = max(t_prev + (h + margin) / vy, t_prev + length / v_prev - (length - margin) / vy)
+                        t0 += self.rng.exponential(self.fps * 1.5)
+                    if t0 >= self.n_frames:
+                        break
+                    y0 = -margin if direction == 1 else self.height + margin
+                    vehicles.append(dict(id=len(vehicles), cls=cls, x=x, y0=y0, vy=vy * direction, t0=t0,
+                                         w=self.sprites[cls]['w'], h=h, speed=speed, direction=direction))
+                    t_prev, v_prev = t0, vy
+        return vehicles
+
+    def boxes(self, frameid):
+        """Ground truth bounding boxes of the visible vehicles
+
+        Args:
+            frameid (int): frame index
+        Returns:
+            boxes (list of tuple): (vehicle id, x1, y1, x2, y2, cls) of the (partly) visible vehicles
+        """
+        boxes = []
+        for v in self.vehicles:
+            cy = v['y0'] + (frameid - v['t0']) * v['vy']
+            x1, y1 = int(round(v['x'] - v['w'] / 2.)), int(round(cy - v['h'] / 2.))
+            x2, y2 = x1 + v['w'], y1 + v['h']
+            x1c, y1c, x2c, y2c = max(x1, 0), max(y1, 0), min(x2, self.width), min(y2, self.height)
+            if x2c > x1c and y2c > y1c:
+                boxes.append((v['id'], x1, y1, x2, y2, v['cls']))
+        return boxes
+
+    def render_frame(self, frameid):
+        """Renders a frame
+
+        Args:
+            frameid (int): frame index
+        Returns:
+            img (numpy 2D array): rendered frame
+        """
+        img = self.background.copy()
+        for _, x1, y1, x2, y2, cls in self.boxes(frameid):
+            sprite = self.sprites[cls]
+            x1c, y1c, x2c, y2c = max(x1, 0), max(y1, 0), min(x2, self.width), min(y2, self.height)
+            src = (slice(y1c - y1, y2c - y1), slice(x1c - x1, x2c - x1))
+            dst = img[y1c:y2c, x1c:x2c]
+            mask = sprite['mask'][src]
+            dst[mask] = sprite['img'][src][mask]
+        return img
+
+    def render(self, path):
+        """Renders the clip to a video file
+
+        Args:
+            path (str): path of the output video (.avi)
+        """
+        fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+        out = cv2.VideoWriter(path, fourcc, self.fps, (self.width, self.height))
+        for frameid in range(self.n_frames):
+            out.write(self.render_frame(frameid))
+        out.release()
+
+    def true_counts(self, border):
+        """Ground truth counts of a counter line : vehicles whose centroid crosses the line during the clip
+
+        Args:
+            border (tuple of int): x1, y1, x2, y2 counter line
+        Returns:
+            counts (dict): dictionnary of classes and their counts
+        """
+        x1, y1, x2, y2 = border
+        counts = dict(zip(self.classes, [0] * len(self.classes)))
+        for v in self.vehicles:
+            t_cross = v['t0'] + (y1 - v['y0']) / v['vy']
+            if min(x1, x2) <= v['x'] <= max(x1, x2) and 0 <= t_cross < self.n_frames - 1:
+                counts[v['cls']] += 1
+        return counts
+
+    def true_speeds(self, czone_ini):
+        """Ground truth speeds of the vehicles going through a control zone during the clip
+
+        Args:
+            czone_ini (dict): control zone, same format as Config.parse_czones
+        Returns:
+            speeds (dict): dictionnary of vehicle ids and their speeds in km/h
+        """
+        (xs1, ys), (xs2, _) = czone_ini['start']
+        (_, ye), _ = czone_ini['exit']
+        speeds = {}
+        for v in self.vehicles:
+            t_start = v['t0'] + (ys - v['y0']) / v['vy']
+            t_exit = v['t0'] + (ye - v['y0']) / v['vy']
+            if min(xs1, xs2) <= v['x'] <= max(xs1, xs2) and 0 <= t_start < t_exit < self.n_frames - 1:
+                speeds[v['id']] = v['speed']
+        return speeds
+
+
+class SyntheticDetector:
+    """SyntheticDetector class is a stand-in of YOLOV3Detector returning the ground truth boxes of a SyntheticClip
+    with jitter and dropouts
+
+    Args:
+        clip (SyntheticClip object): rendered clip
+        video_capture (opencv object): opencv video iterator reading the rendered clip
+        jitter (float): standard deviation in pixels of the noise added to the boxes corners
+        dropout (float): probability of missing a vehicle on a frame
+        seed (int): random seed
+
+    Attributes:
+        clip (SyntheticClip object): rendered clip
+        cap (opencv object): opencv video iterator reading the rendered clip
+        jitter (float): standard deviation in pixels of the noise added to the boxes corners
+        dropout (float): probability of missing a vehicle on a frame
+    """
+
+    def __init__(self, clip, video_capture, jitter=2., dropout=0.05, seed=0):
+        self.clip = clip
+        self.cap = video_capture
+        self.jitter = jitter
+        self.dropout = dropout
+        self.rng = np.random.RandomState(seed)
+
+    def detect(self, img, pool=None):
+        """Same interface as YOLOV3Detector.detect
+
+        Args:
+            img (numpy 2D array): input image
+            pool (FramePool object): optional pool of the result image buffer
+        Returns:
+            result (numpy 2D array) : the input image with detected objects drawn
+            detections (numpy structured array): detected objects of detections.DETECTION_DTYPE,
+                                                 class ids are the indexes of the names in clip.classes
+        """
+        frameid = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1
+        if pool is not None:
+            result = pool.get('detector_result', img.shape, img.dtype)
+            np.copyto(result, img)
+        else:
+            result = img.copy()
+        detections = []
+        class_ids = {name: i for i, name in enumerate(self.clip.classes)}
+        for _, x1, y1, x2, y2, cls in self.clip.boxes(frameid):
+            if self.rng.random_sample() < self.dropout:
+                continue
+            x1, y1, x2, y2 = np.round(np.array([x1, y1, x2, y2]) + self.rng.normal(0, self.jitter, 4)).astype(int)
+            x1, y1 = max(x1, 0), max(y1, 0)
+            x2, y2 = min(x2, self.clip.width - 1), min(y2, self.clip.height - 1)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            cv2.rectangle(result, (x1, y1), (x2, y2), (0, 255, 255), 2)
+            detections.append((x1, y1, x2, y2, 90., class_ids[cls]))
+        return result, np.array(detections, dtype=DETECTION_DTYPE)
+
+    def close(self):
+        pass
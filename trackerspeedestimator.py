@@ -1,10 +1,14 @@
 #! /usr/bin/env python3
 # coding: utf-8
 
+import copy
+
 import numpy as np
-from scipy.spatial import distance as dist
+from scipy.spatial import cKDTree
 
 from centroid_tracker import CentroidTracker
+from detections import boxes, centroids, empty_detections
+from speedstats import ZoneSpeedStats
 from utils import *
 
 
@@ -16,15 +20,20 @@ class TrackerSpeedEstimator:
     Args:
         czones (list of object class): list of Control_zone object class that have been initialized
         video_capture (opencv object): opencv video iterator
+        index (SpatialIndex object): optional spatial index of the control zones
+        max_disappeared (int): number of frames a tracked object can be missing before being deregistered
+        max_distance (float): maximum displacement in pixels of a tracked object between two frames
+                              (not gated if None, gated matches are searched in a KD-tree in dense scenes)
 
     Attributes:
         czones (list of object class): list of Control_zone object class that have been initialized
+        index (SpatialIndex object): optional spatial index of the control zones
         fps (int): number of frames per second of the video
         cap (opencv object): opencv video iterator
         ct (object): CentroidTracker object
         mapped_centroid_classes (dict): dictionnary of tracked elements
-                                            and their detected classes
-                                            (ie {0:'car',1: 'car',2:'truck'} )
+                                            and their detected class ids
+                                            (ie {0: 0, 1: 0, 2: 1} )
         tracked_objects_status (dict): dictionnary of tracked elements
                                             and their control zone status,
                                             idzone belongings and number of displayed time
@@ -39,41 +48,66 @@ class TrackerSpeedEstimator:
                                             (ie {1: {0: 104.4, 8: 104.4},
                                                  2: {2: 100.8, 6: 127.095}
                                                  })
+        speed_stats (dict): dictionnary of the control zones and their streaming speed statistics
+                                            (ie {1: ZoneSpeedStats, 2: ZoneSpeedStats})
 
     """
 
-    def __init__(self, video_capture, czones):
+    def __init__(self, video_capture, czones, index=None, max_disappeared=8, max_distance=None):
         self.czones = czones
+        self.index = index
         self.fps = int(video_capture.get(cv2.CAP_PROP_FPS))
         self.cap = video_capture
-        self.ct = CentroidTracker(maxDisappeared=8)
+        self.ct = CentroidTracker(maxDisappeared=max_disappeared, maxDistance=max_distance)
         self.mapped_centroid_classes = {}
         self.tracked_objects_status = {}
         self.frameid_control = {}
-        self.estimated_speed = {}
+        self.estimated_speed = {czone.idczone: {} for czone in czones}
+        self.speed_stats = {czone.idczone: ZoneSpeedStats(czone.speedlimit) for czone in czones}
+
+    def get_state(self):
+        """Returns a copy of the tracking and speed estimation state, including the CentroidTracker state
+        """
+        return dict(ct=self.ct.get_state(),
+                    mapped_centroid_classes=dict(self.mapped_centroid_classes),
+                    tracked_objects_status=dict(self.tracked_objects_status),
+                    frameid_control={k: list(v) for k, v in self.frameid_control.items()},
+                    estimated_speed={k: dict(v) for k, v in self.estimated_speed.items()},
+                    speed_stats=copy.deepcopy(self.speed_stats))
+
+    def set_state(self, state):
+        """Restores the tracking and speed estimation state saved by get_state
+        """
+        self.ct.set_state(state['ct'])
+        self.objects = self.ct.objects
+        self.detections = empty_detections()
+        self.mapped_centroid_classes = dict(state['mapped_centroid_classes'])
+        self.tracked_objects_status = dict(state['tracked_objects_status'])
+        self.frameid_control = {k: list(v) for k, v in state['frameid_control'].items()}
+        self.estimated_speed.update({k: dict(v) for k, v in state['estimated_speed'].items()})
+        self.speed_stats.update(copy.deepcopy(state['speed_stats']))
 
     def track(self, detections):
         """update the tracker with the centroid of the detected elements
         Args:
-            detections (list of numpy array): list of bounding box coordinates of the detected elements
-                                        (ie [np.array([252,266,175,112]]),np.array([112,186,375,121]])])
+            detections (numpy structured array): detected elements of detections.DETECTION_DTYPE
         """
         # object Tracking
         self.detections = detections
-        bboxes = [np.array(i[:4]).astype(int) for i in self.detections]
-        self.objects = self.ct.update(bboxes)
+        self.objects = self.ct.update(boxes(self.detections))
 
 
     def map_centroid_class(self):
         """Maps the tracked objects ids with the detected object classes using centroids and bounding boxes
         Note :
               the mapping is realized according the the minimal distance bewteen two centroids
+              on frames without detections the previous mapping is kept
         """
-        centroid_bboxes = np.array([((x1 + x2) / 2, ((y1 + y2) / 2)) for x1, y1, x2, y2, conf, cls in self.detections])
-        for (objectID, centroid) in self.objects.items():
-            distances = dist.cdist(np.expand_dims(centroid, axis=0), centroid_bboxes)
-            imaped_bbox = distances.argmin(axis=1)[0]
-            self.mapped_centroid_classes[objectID] = self.detections[imaped_bbox][5]
+        if len(self.detections) == 0 or len(self.objects) == 0:
+            return
+        _, nearest = cKDTree(centroids(self.detections)).query(np.array(list(self.objects.values())))
+        cls = self.detections['cls'][nearest]
+        self.mapped_centroid_classes.update(zip(self.objects.keys(), cls.tolist()))
 
     def _update_status(self, obj_id, centroid, cz):
         """update the tracked elements informations to know when an element is not yet in the control zone,
@@ -99,14 +133,36 @@ class TrackerSpeedEstimator:
 
         status, idczone, ndisplay = self.tracked_objects_status[obj_id]
         if cz.entering_zone(centroid):
-            # if status != 1:
-            self.tracked_objects_status[obj_id] = (1, cz.idczone, 0)
-            self.frameid_control[obj_id] = [frameid]
+            self._enter_zone(obj_id, cz, frameid)
 
         if idczone == cz.idczone:
             if cz.exiting_zone(centroid):
-                self.tracked_objects_status[obj_id] = (2, idczone, 0)
-                self.frameid_control[obj_id].append(frameid)
+                self._exit_zone(obj_id, cz, frameid)
+
+    def _enter_zone(self, obj_id, cz, frameid):
+        """Sets the status of a tracked element crossing the start line of a control zone
+        """
+        # if status != 1:
+        self.tracked_objects_status[obj_id] = (1, cz.idczone, 0)
+        self.frameid_control[obj_id] = [frameid]
+
+    def _exit_zone(self, obj_id, cz, frameid):
+        """Sets the status of a tracked element crossing the end line of the control zone it has entered
+        """
+        self.tracked_objects_status[obj_id] = (2, cz.idczone, 0)
+        self.frameid_control[obj_id].append(frameid)
+
+    def _measure_speed(self, obj_id, cz):
+        """Estimates the speed of a tracked element which has crossed the control zone (status = 2)
+        """
+        status, idczone, ndisplay = self.tracked_objects_status[obj_id]
+
+        if status == 2 and (idczone == cz.idczone):
+            n_present_frames = self.frameid_control[obj_id][-1] - self.frameid_control[obj_id][0]
+            speed = ((cz.ckzn_d / (n_present_frames / self.fps)) * 3600) / 1000  # km/h
+            if self.estimated_speed[idczone].get(obj_id) != speed:
+                self.speed_stats[idczone].add(obj_id, speed, self.frameid_control[obj_id][-1] / self.fps)
+            self.estimated_speed[idczone].update({obj_id: speed})
 
     def compute_speed(self):
         """Compute the speed for each tracked elements crossing each control zone
@@ -115,53 +171,78 @@ class TrackerSpeedEstimator:
               only elements with status = 2 are measured using information of the entering and exiting frame ids
               knowing the length of between the entering and the exiting zone ,
               the number of frames in the control zone and the frame rate, we can estimate the speed of the object.
+              When a spatial index is set, each centroid is only tested against the control zones of its grid cell.
         """
+        if self.index is not None:
+            self._compute_speed_indexed()
+            return
+
         for czone in self.czones:
-            if not (czone.idczone in self.estimated_speed.keys()):
-                self.estimated_speed[czone.idczone] = {}
             for (objectID, centroid) in self.objects.items():
                 self._update_status(objectID, centroid, czone)
+                self._measure_speed(objectID, czone)
 
-                status, idczone, ndisplay = self.tracked_objects_status[objectID]
+    def _compute_speed_indexed(self):
+        """compute_speed using the spatial index : only the control zones whose start or end line
+        contains the centroid are updated
+        """
+        frameid = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        for (objectID, centroid) in self.objects.items():
+            if not (objectID in self.tracked_objects_status.keys()):
+                self.tracked_objects_status[objectID] = (0, None, 0)
+
+            hits = [(owner, tag) for owner, tag in self.index.query(centroid) if tag in ('start', 'exit')]
+            czones = []
+            for owner, _ in hits:
+                if owner not in czones:
+                    czones.append(owner)
 
-                if status == 2 and (idczone == czone.idczone):
-                    n_present_frames = self.frameid_control[objectID][-1] - self.frameid_control[objectID][0]
-                    speed = ((czone.ckzn_d / (n_present_frames / self.fps)) * 3600) / 1000  # km/h
-                    self.estimated_speed[idczone].update({objectID: speed})
+            for czone in czones:
+                status, idczone, ndisplay = self.tracked_objects_status[objectID]
+                if (czone, 'start') in hits:
+                    self._enter_zone(objectID, czone, frameid)
+                if idczone == czone.idczone and (czone, 'exit') in hits:
+                    self._exit_zone(objectID, czone, frameid)
+                self._measure_speed(objectID, czone)
 
     def display_speed(self, img, ndisplay_frames=20):
         """Displays the speed of each measured objects and the average speed for each control zone
         Note :
               only the speed of status = 2 elements is displayed during ndisplay_frames
               If an element if over the speed limit, the speed is displayed as red
+              The displayed speeds must be aged on every frame, with img=None when the frame is not drawn
         Args:
-             img (numpy 2D array): input image
+             img (numpy 2D array): input image (nothing is drawn if None)
              ndisplay_frames (int): maximum number of displayed speed frames for each tracked objects
         """
         speedlimits = {}
         for czone in self.czones:
             speedlimits[czone.idczone] = czone.speedlimit
 
-        shape = img.shape[:2]
         for (objectID, centroid) in self.objects.items():
             status, idczone, ndisplay = self.tracked_objects_status[objectID]
             if status == 2:
                 if ndisplay <= ndisplay_frames:
-                    speed = self.estimated_speed[idczone][objectID]
-                    centroid = self.objects[objectID]
-                    cv2.putText(img, "{0:.1f} : km/h".format(speed), (centroid[0] - 15, centroid[1] + 40),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                                over_speed_color((0, 255, 0), speed, speedlimits[idczone]),
-                                1)
+                    if img is not None:
+                        speed = self.estimated_speed[idczone][objectID]
+                        centroid = self.objects[objectID]
+                        cv2.putText(img, "{0:.1f} : km/h".format(speed), (centroid[0] - 15, centroid[1] + 40),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                                    over_speed_color((0, 255, 0), speed, speedlimits[idczone]),
+                                    1)
                     self.tracked_objects_status[objectID] = (status, idczone, ndisplay + 1)
                 else:
                     self.tracked_objects_status[objectID] = (0, None, 0)
 
+        if img is None:
+            return
+
+        shape = img.shape[:2]
         i = 0
         for czone in self.czones:
             idczone = czone.idczone
-            if len(self.estimated_speed[idczone]) > 0:
-                mspeed = np.array(list(self.estimated_speed[idczone].values())).mean()
+            if self.speed_stats[idczone].n > 0:
+                mspeed = self.speed_stats[idczone].mean
                 offset_r, offset_c = offset_loc(czone.draw_loc)
                 x, y = (
                     (shape[1] // 2) + (offset_c * (shape[1] // 4)),
@@ -171,6 +252,15 @@ class TrackerSpeedEstimator:
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
             i += 1
 
+    def zone_stats(self):
+        """Returns the streaming speed statistics of each control zone at the current frame time
+
+        Returns:
+            stats (dict): dictionnary of the control zones and their statistics (see ZoneSpeedStats.query)
+        """
+        t = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) / self.fps
+        return {idczone: stats.query(t=t) for idczone, stats in self.speed_stats.items()}
+
     def display_tracking(self, img):
         """Displays the centroid and the IDs of the tracked objects
         Args:
@@ -0,0 +1,309 @@
+#! /usr/bin/env python3
+# coding: utf-8
+
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+COLUMNS = [('frame', np.int32), ('track_id', np.int32), ('x', np.int32), ('y', np.int32), ('cls', np.int16)]
+
+
+class TrackLogWriter:
+    """TrackLogWriter class appends the tracked objects of every frame to a columnar track log on disk
+
+    Note : the track log is a directory with one raw binary file per column (frame, track_id, x, y, cls)
+           and a meta.json file. Rows are buffered in memory and written by batches from a background thread,
+           so the frame loop never waits for the disk. The frame and track id indexes are built on close.
+           meta.json is written on creation and marked complete on close, a log left incomplete by a crash
+           is still readable : TrackLog rebuilds its indexes from the column files.
+           When the pipeline resumes from a snapshot, the existing log is kept up to resume_frame (the rows
+           logged after the snapshot are dropped) and the new rows are appended to it. sync() writes the
+           buffered rows before a snapshot, so the snapshot rows are on disk when the pipeline resumes.
+
+    Args:
+        path (str): track log directory
+        batch_size (int): number of rows buffered before a batch is handed to the writing thread
+        fps (int): frame rate of the video
+        classes (list of str): class table of the tracked objects class ids
+        scale (float): resize factor of the tracked frames from the input video (frame cache)
+        offset (tuple of int): (x, y) crop offset in pixels of the input video of the tracked frames (frame cache)
+        resume_frame (int): first frame of the resumed video, the existing log is continued from this frame
+                            (a new log is created if None)
+        resume_rows (int): number of rows of the log at the snapshot time (TrackLogWriter.sync), an error is
+                           raised if the existing log has less rows
+
+    Attributes:
+        path (str): track log directory
+        fps (int): frame rate of the video
+        batch_size (int): number of rows buffered before a batch is handed to the writing thread
+        classes (list of str): class table, the cls column stores the class ids (-1 for an unknown class)
+        scale (float): resize factor of the tracked frames from the input video
+        offset (tuple of int): (x, y) crop offset in pixels of the input video of the tracked frames
+        n_rows (int): number of rows appended
+        n_frames (int): number of frames appended
+    """
+
+    def __init__(self, path, batch_size=4096, fps=None, classes=(), scale=1., offset=(0, 0), resume_frame=None,
+                 resume_rows=None):
+        self.path = path
+        self.fps = fps
+        self.batch_size = batch_size
+        self.classes = list(classes)
+        self.scale = scale
+        self.offset = tuple(offset)
+        self.n_rows = 0
+        self.n_frames = 0
+        self._buffer = []
+        self._error = None
+
+        os.makedirs(self.path, exist_ok=True)
+        mode = 'wb'
+        if resume_frame is not None and (os.path.exists(os.path.join(self.path, 'frame.bin')) or resume_rows):
+            self._truncate(resume_frame, resume_rows)
+            mode = 'ab'
+        self._files = {name: open(os.path.join(self.path, name + '.bin'), mode) for name, _ in COLUMNS}
+        self._write_meta(complete=False)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_batches, daemon=True)
+        self._thread.start()
+
+    def append(self, frameid, objects, mapped_centroid_classes):
+        """Appends the tracked objects of a frame
+
+        Args:
+            frameid (int): frame index
+            objects (dict): dictionnary of centroid coordinated of tracked elements in the image
+            mapped_centroid_classes (dict): dictionnary of tracked elements and their detected class ids
+        """
+        for (objectID, centroid) in objects.items():
+            cls = mapped_centroid_classes.get(objectID, -1)
+            self._buffer.append((frameid, objectID, centroid[0], centroid[1], cls))
+        self.n_frames = max(self.n_frames, frameid + 1)
+
+        if len(self._buffer) >= self.batch_size:
+            self._flush()
+
+    def sync(self):
+        """Writes the buffered rows and waits for the writing thread
+
+        Returns:
+            n_rows (int): number of rows written to the column files
+        """
+        self._flush()
+        self._queue.join()
+        self._check_error()
+        return self.n_rows
+
+    def close(self):
+        """Writes the remaining rows, builds the frame and track id indexes and writes the meta file
+        """
+        self._flush()
+        self._queue.put(None)
+        self._thread.join()
+        for f in self._files.values():
+            f.close()
+        self._check_error()
+
+        log = TrackLog(self.path, with_index=False)
+        indexes = build_indexes(log.columns['frame'], log.columns['track_id'], self.n_frames)
+        for name, index in indexes.items():
+            np.save(os.path.join(self.path, name + '.npy'), index)
+        self._write_meta(complete=True)
+
+    def _truncate(self, resume_frame, resume_rows=None):
+        """Drops the rows of the existing log from resume_frame on, so that the resumed frames are not logged twice
+        """
+        if not os.path.exists(os.path.join(self.path, 'frame.bin')):
+            raise IOError("Track log {} not found, the snapshot expects {} rows".format(self.path, resume_rows))
+        log = TrackLog(self.path, with_index=False)
+        if resume_rows is not None and log.n_rows < resume_rows:
+            raise IOError("Track log {} has {} rows, the snapshot expects {} rows".format(
+                self.path, log.n_rows, resume_rows))
+        self.n_rows = int(np.searchsorted(log.columns['frame'], resume_frame))
+        self.n_frames = resume_frame
+        del log
+        for name, dtype in COLUMNS:
+            os.truncate(os.path.join(self.path, name + '.bin'), self.n_rows * np.dtype(dtype).itemsize)
+
+    def _write_meta(self, complete):
+        """Writes the meta file (replaced atomically), the rows and frames numbers are only set when complete
+        """
+        meta = dict(complete=complete, n_rows=self.n_rows if complete else None,
+                    n_frames=self.n_frames if complete else None, fps=self.fps, classes=self.classes,
+                    scale=self.scale, offset=self.offset, columns=[(name, np.dtype(dtype).str) for name, dtype in COLUMNS])
+        tmp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def _check_error(self):
+        """Raises the exception of the writing thread (ie disk full), the rows are not written anymore after it
+        """
+        if self._error is not None:
+            raise IOError("Track log {} writing failed : {}".format(self.path, self._error)) from self._error
+
+    def _flush(self):
+        """Hands the buffered rows to the writing thread
+        """
+        self._check_error()
+        if len(self._buffer) == 0:
+            return
+        batch = np.array(self._buffer, dtype=np.int64)
+        self.n_rows += len(batch)
+        self._buffer = []
+        self._queue.put(batch)
+
+    def _write_batches(self):
+        """Writing thread : appends each batch to the column files
+        """
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    break
+                if self._error is None:
+                    for i, (name, dtype) in enumerate(COLUMNS):
+                        self._files[name].write(batch[:, i].astype(dtype).tobytes())
+                        self._files[name].flush()
+            except Exception as e:
+                # kept for _flush, sync and close, the next batches are not written
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+
+def build_indexes(frame, track_id, n_frames):
+    """Builds the frame and track id indexes of a track log
+
+    Args:
+        frame (numpy array): frame column (sorted)
+        track_id (numpy array): track id column
+        n_frames (int): number of frames
+    Returns:
+        indexes (dict): frame_offsets, track_order, track_ids and track_offsets arrays
+    """
+    frame_offsets = np.searchsorted(frame, np.arange(n_frames + 1)).astype(np.int64)
+    track_order = np.argsort(track_id, kind='stable').astype(np.int64)
+    track_ids, track_offsets = np.unique(np.asarray(track_id)[track_order], return_index=True)
+    track_offsets = np.append(track_offsets, len(track_id)).astype(np.int64)
+    return dict(frame_offsets=frame_offsets, track_order=track_order, track_ids=track_ids,
+                track_offsets=track_offsets)
+
+
+class TrackLog:
+    """TrackLog class gives a memory-mapped random access to a track log written by TrackLogWriter
+
+    Note : a log that was not closed (crash) is recovered : the rows written to all the column files are read
+           and the indexes are rebuilt in memory.
+
+    Args:
+        path (str): track log directory
+        with_index (bool): load the frame and track id indexes
+
+    Attributes:
+        path (str): track log directory
+        n_rows (int): number of rows
+        n_frames (int): number of frames
+        fps (int): frame rate of the video
+        classes (list of str): class table
+        scale (float): resize factor of the tracked frames from the input video (frame cache)
+        offset (tuple of int): (x, y) crop offset in pixels of the input video of the tracked frames (frame cache)
+        columns (dict): dictionnary of the memory-mapped columns (ie {'frame': memmap, 'track_id': memmap, ...})
+        complete (bool): False if the log was recovered from a writer that was not closed
+    """
+
+    def __init__(self, path, with_index=True):
+        self.path = path
+        meta_path = os.path.join(self.path, 'meta.json')
+        meta = dict(complete=False, classes=[], scale=1., offset=(0, 0), columns=[(name, np.dtype(dtype).str) for name, dtype in COLUMNS])
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta.update(json.load(f))
+        index_names = ['frame_offsets', 'track_order', 'track_ids', 'track_offsets']
+        self.complete = meta['complete'] and all(os.path.exists(os.path.join(self.path, name + '.npy'))
+                                                 for name in index_names)
+        self.fps = meta.get('fps')
+        self.classes = meta['classes']
+        self.scale = meta['scale']
+        self.offset = tuple(meta['offset'])
+
+        if self.complete:
+            self.n_rows = meta['n_rows']
+        else:
+            # rows fully written to every column file
+            self.n_rows = min(os.path.getsize(os.path.join(self.path, name + '.bin')) // np.dtype(dtype).itemsize
+                              for name, dtype in meta['columns'])
+
+        self.columns = {}
+        for name, dtype in meta['columns']:
+            if self.n_rows == 0:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(os.path.join(self.path, name + '.bin'), dtype=dtype, mode='r',
+                                               shape=(self.n_rows,))
+
+        if self.complete:
+            self.n_frames = meta['n_frames']
+        else:
+            self.n_frames = int(self.columns['frame'][-1]) + 1 if self.n_rows > 0 else 0
+
+        if with_index and self.complete:
+            self.frame_offsets = np.load(os.path.join(self.path, 'frame_offsets.npy'), mmap_mode='r')
+            self.track_order = np.load(os.path.join(self.path, 'track_order.npy'), mmap_mode='r')
+            self.track_ids = np.load(os.path.join(self.path, 'track_ids.npy'))
+            self.track_offsets = np.load(os.path.join(self.path, 'track_offsets.npy'))
+        elif with_index:
+            indexes = build_indexes(self.columns['frame'], self.columns['track_id'], self.n_frames)
+            for name, index in indexes.items():
+                setattr(self, name, index)
+
+    def __len__(self):
+        return self.n_rows
+
+    def frame(self, frameid):
+        """Returns the rows of a frame
+
+        Args:
+            frameid (int): frame index
+        Returns:
+            rows (dict): dictionnary of the column slices of the frame (zero-copy views)
+        """
+        if frameid < 0 or frameid >= self.n_frames:
+            return {name: col[:0] for name, col in self.columns.items()}
+        start, end = self.frame_offsets[frameid], self.frame_offsets[frameid + 1]
+        return {name: col[start:end] for name, col in self.columns.items()}
+
+    def track(self, track_id):
+        """Returns the rows of a tracked object, sorted by frame
+
+        Args:
+            track_id (int): id of the tracked object
+        Returns:
+            rows (dict): dictionnary of the column arrays of the tracked object
+        """
+        i = np.searchsorted(self.track_ids, track_id)
+        if i == len(self.track_ids) or self.track_ids[i] != track_id:
+            return {name: col[:0] for name, col in self.columns.items()}
+        rows = self.track_order[self.track_offsets[i]:self.track_offsets[i + 1]]
+        return {name: col[rows] for name, col in self.columns.items()}
+
+    def objects(self, frameid):
+        """Returns a frame in the CentroidTracker format
+
+        Args:
+            frameid (int): frame index
+        Returns:
+            objects (dict): dictionnary of centroid coordinated of tracked elements (ie {0: [250,470],1: [410,520]})
+            mapped_centroid_classes (dict): dictionnary of tracked elements and their class ids (ie {0: 0, 1: 0}),
+                                            names are given by self.classes
+        """
+        rows = self.frame(frameid)
+        objects, mapped_centroid_classes = {}, {}
+        for track_id, x, y, cls in zip(rows['track_id'], rows['x'], rows['y'], rows['cls']):
+            objects[int(track_id)] = np.array([x, y])
+            if cls >= 0:
+                mapped_centroid_classes[int(track_id)] = int(cls)
+        return objects, mapped_centroid_classes
@@ -34,7 +34,7 @@ def point_inside_polygon(x, y, poly):
     return inside
 
 
-def is_crossing_line(x, y, line_pts, tresh=0.01):
+def is_crossing_line(x, y, line_pts, tresh=0.01, y_shift=0):
     """
     Check if a point (x,y) is near to a line
     Note : we build a small polygone from the line
@@ -44,21 +44,39 @@ def is_crossing_line(x, y, line_pts, tresh=0.01):
         y (int): y coordinate of the point
         line_pts (tuple of int):
         tresh (float): treshold of the extented polygone
+        y_shift (float): y offset of the image in the input video (see line_band)
 
     Returns :
             bool : True is the point is in the line , False otherwise
     """
+    poly = line_band(line_pts, tresh, y_shift)
+    return point_inside_polygon(x, y, poly)
+
+
+def line_band(line_pts, tresh=0.01, y_shift=0):
+    """
+    Build the small polygone around a line used by is_crossing_line
+    Note : the polygone thickness is proportional to the y of the line in the input video, y_shift is the y of the
+           image top in the input video (cropped frame cache) so that the polygone is the same as on the input video
+
+    Args:
+        line_pts (tuple of int): the two (x,y) points of the line
+        tresh (float): treshold of the extented polygone
+        y_shift (float): y offset of the image in the input video, in pixels of the image
+
+    Returns :
+            poly (list of tuple float): polygone list of (x,y) coordinates
+    """
     tresh_up = 1 + tresh
     tresh_dnw = 1 - tresh
     x1, y1 = line_pts[0]
     x2, y2 = line_pts[1]
-    x3, y3 = x1, y1 * tresh_dnw
-    x4, y4 = x2, y2 * tresh_dnw
-    x5, y5 = x2, y2 * tresh_up
-    x6, y6 = x1, y1 * tresh_up
+    x3, y3 = x1, y1 * tresh_dnw - y_shift * tresh
+    x4, y4 = x2, y2 * tresh_dnw - y_shift * tresh
+    x5, y5 = x2, y2 * tresh_up + y_shift * tresh
+    x6, y6 = x1, y1 * tresh_up + y_shift * tresh
 
-    poly = [(x3, y3), (x4, y4), (x5, y5), (x6, y6)]
-    return point_inside_polygon(x, y, poly)
+    return [(x3, y3), (x4, y4), (x5, y5), (x6, y6)]
 
 
 def load_icons(classes):